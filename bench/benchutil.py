@@ -0,0 +1,222 @@
+# vim: noexpandtab ts=2 sw=2 sts=2
+
+# helpers shared by the benchmark scripts
+
+import copy
+import datetime
+import http.server
+import importlib.machinery
+import importlib.util
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+BASEDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+FIXTURE = os.path.join(BASEDIR, 'test', 'nodes.json')
+
+sys.path.append(BASEDIR)
+
+# imports config.py, falling back to config.py.example, and redirects all paths
+# written by the bot into a temporary directory
+def load_config():
+	try:
+		import config
+	except ImportError:
+		loader = importlib.machinery.SourceFileLoader('config', os.path.join(BASEDIR, 'config.py.example'))
+		spec = importlib.util.spec_from_loader('config', loader)
+		config = importlib.util.module_from_spec(spec)
+		spec.loader.exec_module(config)
+		sys.modules['config'] = config
+
+	workdir = tempfile.mkdtemp(prefix='freifunk_bench_')
+	redirect_paths(config, workdir)
+
+	config.BENCH_WORKDIR = workdir
+	return config
+
+# points all paths written by the bot into workdir and creates a new database there
+def redirect_paths(config, workdir):
+	os.makedirs(workdir, exist_ok=True)
+
+	config.DATABASE = os.path.join(workdir, 'data.sqlite')
+	config.DISTSERV_FIFO = os.path.join(workdir, 'distserv.fifo')
+	config.PLOT_DIR = os.path.join(workdir, 'plots')
+	config.PLOT_CACHE_MANIFEST = os.path.join(workdir, 'plotcache.json')
+	for name in ['LOG_NODECOUNT', 'LOG_ONLINENODECOUNT', 'LOG_TOTALCLIENTCOUNT', 'LOG_NODECLIENTCOUNT', 'LOG_NODENAMES', 'TSSTORE_DIR', 'CHECKPOINT_FILE']:
+		if getattr(config, name):
+			setattr(config, name, os.path.join(workdir, os.path.basename(getattr(config, name))))
+
+	init_database(config.DATABASE)
+
+# creates the bot's tables in a new database
+def init_database(path):
+	with open(os.path.join(BASEDIR, 'sql', 'setup.sql'), 'r') as sqlfile:
+		db = sqlite3.connect(path)
+		db.executescript(sqlfile.read())
+		db.close()
+
+def load_fixture():
+	with open(FIXTURE, 'r') as f:
+		return json.load(f)
+
+def synthetic_mac(i):
+	return '02:{:02x}:{:02x}:{:02x}:{:02x}:{:02x}'.format(
+		(i >> 32) & 0xff, (i >> 24) & 0xff, (i >> 16) & 0xff, (i >> 8) & 0xff, i & 0xff)
+
+# a copy of the fixture node template with the MAC address and hostname of node i
+def synthetic_node(template, i):
+	node = copy.deepcopy(template)
+	mac = synthetic_mac(i)
+	node['nodeinfo']['network']['mac'] = mac
+	node['nodeinfo']['node_id'] = mac.replace(':', '')
+	node['nodeinfo']['hostname'] = '{}-{}'.format(node['nodeinfo'].get('hostname', 'node'), i)
+	return node
+
+# builds a nodes.json document with num_nodes entries by cycling through the
+# fixture's nodes and giving every copy its own MAC address and hostname
+def scale_nodes_json(num_nodes, fixture=None):
+	if fixture is None:
+		fixture = load_fixture()
+
+	templates = list(fixture['nodes'].values())
+	nodes = {}
+	for i in range(num_nodes):
+		node = synthetic_node(templates[i % len(templates)], i)
+		nodes[node['nodeinfo']['node_id']] = node
+
+	return {'timestamp': fixture['timestamp'], 'nodes': nodes}
+
+# A network generated from the fixture that changes from one cycle to the next.
+# Per cycle, the given fractions of the nodes
+#   churn:   leave the network and are replaced by new nodes
+#   rename:  get a new hostname
+#   flap:    change their online status
+#   clients: get a new client count
+# The document's timestamp advances by interval seconds per cycle.
+class SyntheticNetwork:
+	def __init__(self, num_nodes, churn=0.01, rename=0.005, flap=0.01, clients=0.2, interval=60, seed=0):
+		self.churn = churn
+		self.rename = rename
+		self.flap = flap
+		self.clients = clients
+		self.interval = interval
+
+		self.rng = random.Random(seed)
+		fixture = load_fixture()
+		self.templates = list(fixture['nodes'].values())
+		self.doc = scale_nodes_json(num_nodes, fixture)
+		self.next_index = num_nodes
+		self.next_rename = 0
+
+		self.time = datetime.datetime.fromisoformat(fixture['timestamp'])
+
+	def step(self):
+		nodes = self.doc['nodes']
+		rng = self.rng
+
+		for key in rng.sample(list(nodes), int(len(nodes) * self.churn)):
+			del nodes[key]
+			node = synthetic_node(rng.choice(self.templates), self.next_index)
+			nodes[node['nodeinfo']['node_id']] = node
+			self.next_index += 1
+
+		entries = list(nodes.values())
+		for node in rng.sample(entries, int(len(entries) * self.rename)):
+			node['nodeinfo']['hostname'] = 'renamed-{}'.format(self.next_rename)
+			self.next_rename += 1
+
+		for node in rng.sample(entries, int(len(entries) * self.flap)):
+			node['flags']['online'] = not node['flags']['online']
+
+		for node in rng.sample(entries, int(len(entries) * self.clients)):
+			node['statistics']['clients'] = rng.randint(0, 40)
+
+		self.time += datetime.timedelta(seconds=self.interval)
+		self.doc['timestamp'] = self.time.strftime('%Y-%m-%dT%H:%M:%S')
+
+	def body(self):
+		return json.dumps(self.doc).encode('utf-8')
+
+# Serves the bodies one after another on a local port, one per request and after
+# an optional delay, in place of the map server. A body may also be the path of
+# a file, which is read for every request. Returns the URI of nodes.json and
+# the server.
+def start_server(bodies, delay=0.0):
+	class Handler(http.server.BaseHTTPRequestHandler):
+		requests = 0
+
+		def do_GET(self):
+			time.sleep(delay)
+			body = bodies[Handler.requests % len(bodies)]
+			Handler.requests += 1
+
+			if isinstance(body, str):
+				with open(body, 'rb') as f:
+					body = f.read()
+
+			self.send_response(200)
+			self.send_header('Content-Type', 'application/json')
+			self.send_header('Content-Length', str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def log_message(self, format, *args):
+			pass
+
+	server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	return 'http://127.0.0.1:{}/nodes.json'.format(server.server_address[1]), server
+
+# stands in for irc.client.ServerConnection and only counts outgoing messages
+class FakeConnection:
+	def __init__(self):
+		self.messages = 0
+
+	def privmsg(self, target, message):
+		self.messages += 1
+
+	def notice(self, target, message):
+		self.messages += 1
+
+	def action(self, target, message):
+		self.messages += 1
+
+	def topic(self, target, topic):
+		self.messages += 1
+
+# hands out prepared nodes.json bodies instead of fetching them
+class FakeFetcher:
+	def __init__(self, bodies):
+		self.bodies = bodies
+		self.index = 0
+
+	def fetch(self):
+		body = self.bodies[self.index % len(self.bodies)]
+		self.index += 1
+		return body
+
+	def commit(self):
+		pass
+
+	def stats(self):
+		return {'bytes': 0, 'latency': 0.0, 'total_bytes': 0, 'skipped_cycles': 0}
+
+# creates a bot that is not connected to any IRC server. With bodies, the first
+# community gets them instead of fetching JSON_URI.
+def make_bot(bodies=None):
+	import freifunk_bot
+
+	config = sys.modules['config']
+	config.RATELIMIT_MESSAGES = 1 << 30
+
+	bot = freifunk_bot.FreifunkBot('#bench')
+	bot.connection = FakeConnection()
+	bot.outboundQueue.setConnection(bot.connection)
+	if bodies is not None:
+		bot.communities[0].fetcher = FakeFetcher(bodies)
+	return bot
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# vim: noexpandtab ts=2 sw=2 sts=2
+
+# load test for the built-in broadcast server: connects many local subscribers
+# and measures how long it takes until every one of them got the snapshot and
+# the events of each cycle. One additional subscriber never reads; it is
+# disconnected as soon as the kernel buffers and BROADCAST_CLIENT_BUFFER are full
+# (see 'disconnected_slow_clients' at the end).
+#
+# usage: bench/broadcast_load.py [num_subscribers] [num_nodes] [num_cycles]
+
+import asyncio
+import contextlib
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+
+import benchutil
+
+config = benchutil.load_config()
+config.BROADCAST_SERVER = True
+config.DISTSERV_HOST = '127.0.0.1'
+config.DISTSERV_PORT = 0
+
+num_subscribers = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+num_nodes = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+num_cycles = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+# documents where the client counts of all nodes change from cycle to cycle
+random.seed(1)
+doc = benchutil.scale_nodes_json(num_nodes)
+bodies = []
+for i in range(num_cycles + 1):
+	for node in doc['nodes'].values():
+		node['statistics']['clients'] = random.randint(0, 30)
+	bodies.append(json.dumps(doc).encode('utf-8'))
+
+bot = benchutil.make_bot(bodies)
+server = bot.communities[0].eventHandler.broadcast
+
+with contextlib.redirect_stdout(open(os.devnull, 'w')):
+	bot.do_freifunk_cycle()
+
+DISCONNECTED = -1.0
+
+snapshot_received = [None] * num_subscribers
+marker_received = [[None] * num_subscribers for i in range(num_cycles)]
+
+async def subscriber(index):
+	reader, writer = await asyncio.open_connection('127.0.0.1', server.port, limit=1 << 26)
+	line = await reader.readline()
+	assert json.loads(line)['type'] == 'snapshot'
+	snapshot_received[index] = time.perf_counter()
+
+	while True:
+		line = await reader.readline()
+		if not line:
+			# disconnected by the server for being too slow
+			for received in marker_received:
+				if received[index] is None:
+					received[index] = DISCONNECTED
+			break
+		if b'bench_marker' in line:
+			marker_received[json.loads(line)['bench_marker']][index] = time.perf_counter()
+
+async def subscribers():
+	await asyncio.gather(*[subscriber(i) for i in range(num_subscribers)])
+
+def wait_for(received):
+	while None in received:
+		time.sleep(0.001)
+	return time.perf_counter()
+
+loop = asyncio.new_event_loop()
+start = time.perf_counter()
+threading.Thread(target=loop.run_until_complete, args=(subscribers(),), daemon=True).start()
+wait_for(snapshot_received)
+print("{} subscribers connected and got the snapshot of {} nodes in {:.3f} s".format(
+	num_subscribers, num_nodes, max(snapshot_received) - start))
+
+# this subscriber never reads
+slow = socket.create_connection(('127.0.0.1', server.port))
+slow.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+
+for cycle in range(num_cycles):
+	with contextlib.redirect_stdout(open(os.devnull, 'w')):
+		bot.do_freifunk_cycle()
+
+	start = time.perf_counter()
+	bot.communities[0].eventHandler.sendBroadcast({'bench_marker': cycle})
+	bot.communities[0].eventHandler.flushBroadcasts()
+	wait_for(marker_received[cycle])
+
+	delivered = [t for t in marker_received[cycle] if t != DISCONNECTED]
+	print("cycle {}: events delivered to {} subscribers after {:.3f} s".format(
+		cycle, len(delivered), max(delivered) - start if delivered else 0))
+
+print(server.stats())
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# vim: noexpandtab ts=2 sw=2 sts=2
+
+# runs one bot with several communities against local HTTP servers serving
+# copies of test/nodes.json. One server answers slowly; the other communities
+# must finish their cycles without waiting for it.
+#
+# usage: bench/communities.py [num_communities] [num_nodes] [delay of the slow server]
+
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+
+import benchutil
+
+config = benchutil.load_config()
+
+num_communities = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+num_nodes = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+delay = float(sys.argv[3]) if len(sys.argv) > 3 else 3.0
+num_cycles = 4
+
+workdir = config.BENCH_WORKDIR
+communities = []
+for i in range(num_communities):
+	random.seed(i)
+	doc = benchutil.scale_nodes_json(num_nodes + i)
+	bodies = []
+	for j in range(2):
+		for node in doc['nodes'].values():
+			node['statistics']['clients'] = random.randint(0, 30)
+		bodies.append(json.dumps(doc).encode('utf-8'))
+
+	# the last community has the slow map server
+	uri, server = benchutil.start_server(bodies, delay if i == num_communities - 1 else 0.0)
+
+	name = 'community{}'.format(i)
+	path = os.path.join(workdir, name)
+	os.makedirs(path)
+
+	settings = {'NAME': name,
+	            'TARGET': '#' + name,
+	            'JSON_URI': uri,
+	            'DATABASE': os.path.join(path, 'data.sqlite'),
+	            'CHECKPOINT_FILE': os.path.join(path, 'checkpoint.json'),
+	            'DISTSERV_FIFO': os.path.join(path, 'distserv.fifo'),
+	            'TSSTORE_DIR': os.path.join(path, 'nodeclients.store')}
+	for key in ['LOG_NODECOUNT', 'LOG_ONLINENODECOUNT', 'LOG_TOTALCLIENTCOUNT', 'LOG_NODECLIENTCOUNT', 'LOG_NODENAMES']:
+		settings[key] = os.path.join(path, os.path.basename(getattr(config, key)))
+
+	benchutil.init_database(settings['DATABASE'])
+	communities.append(settings)
+
+config.COMMUNITIES = communities
+config.CYCLE_DEADLINE = delay / 2
+
+bot = benchutil.make_bot()
+
+# time from the start of a round to the end of each community's cycle
+finished = {}
+
+def timed(community, cycle):
+	def run(*args):
+		cycle(*args)
+		finished[community.name] = time.perf_counter() - round_start
+	return run
+
+for community in bot.communities:
+	community.do_cycle = timed(community, community.do_cycle)
+
+print("{} communities with {} nodes, {} s delay at {}, deadline {} s".format(
+	num_communities, num_nodes, delay, bot.communities[-1].name, config.CYCLE_DEADLINE))
+
+lines = []
+# the late cycles finish while the results are printed, keep their output out
+with contextlib.redirect_stdout(open(os.devnull, 'w')):
+	for cycle in range(num_cycles):
+		finished.clear()
+
+		round_start = time.perf_counter()
+		bot.do_freifunk_cycle()
+		duration = time.perf_counter() - round_start
+
+		results = []
+		for community in bot.communities:
+			if community.name in finished:
+				results.append("{} {:.3f} s".format(community.name, finished[community.name]))
+			else:
+				results.append("{} late".format(community.name))
+		lines.append("cycle {}: waited {:.3f} s; {}".format(cycle, duration, ", ".join(results)))
+
+		# let the slow community finish every other round, so it is started again
+		if cycle % 2 == 0:
+			time.sleep(delay)
+
+	for community in bot.communities:
+		community.future.result()
+
+for line in lines:
+	print(line)
+
+for community in bot.communities:
+	print("{}: {} nodes, notifications to {}".format(community.name, community.snapshot.num_nodes, community.target))
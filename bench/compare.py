@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# vim: noexpandtab ts=2 sw=2 sts=2
+
+# compares two result files of bench/suite.py: the median of every stage of the
+# old and the new run and their ratio. Stages that got slower by more than the
+# threshold are marked.
+#
+# usage: bench/compare.py <old.json> <new.json> [threshold, default 0.1]
+
+import json
+import sys
+
+if len(sys.argv) not in (3, 4):
+	print("Usage: bench/compare.py <old.json> <new.json> [threshold]")
+	sys.exit(1)
+
+with open(sys.argv[1], 'r') as f:
+	old = json.load(f)
+with open(sys.argv[2], 'r') as f:
+	new = json.load(f)
+threshold = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+
+# map of (stage name, summary) of one size
+def stages(result):
+	entries = [('do_freifunk_cycle', result['cycle'])]
+	entries.extend(result['stages'].items())
+	entries.extend(result['commands'].items())
+	return entries
+
+print("old: {} ({})".format(old['revision'], old['date']))
+print("new: {} ({})".format(new['revision'], new['date']))
+if old['parameters'] != new['parameters']:
+	print("Warning: the runs used different parameters.")
+
+old_results = {result['nodes']: result for result in old['results']}
+
+regressions = 0
+for result in new['results']:
+	if result['nodes'] not in old_results:
+		continue
+
+	print("{} nodes".format(result['nodes']))
+	old_stages = dict(stages(old_results[result['nodes']]))
+	for name, summary in stages(result):
+		if name not in old_stages:
+			continue
+
+		before = old_stages[name]['median']
+		after = summary['median']
+		ratio = after / before if before else float('inf')
+		slower = ratio > 1 + threshold
+		regressions += slower
+
+		print("  {:17} {:9.4f} s -> {:9.4f} s  {:6.2f}x{}".format(name, before, after, ratio, '  slower' if slower else ''))
+
+sys.exit(1 if regressions else 0)
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# vim: noexpandtab ts=2 sw=2 sts=2
+
+# writes a series of synthetic nodes.json snapshots derived from test/nodes.json
+# into a directory, e.g. as input for replay.py
+#
+# usage: bench/generate.py <directory> [num_nodes] [num_snapshots] [churn] [rename] [flap]
+
+import os
+import sys
+
+import benchutil
+
+config = benchutil.load_config()
+
+if len(sys.argv) < 2:
+	print("Usage: bench/generate.py <directory> [num_nodes] [num_snapshots] [churn] [rename] [flap]")
+	sys.exit(1)
+
+directory = sys.argv[1]
+num_nodes = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+num_snapshots = int(sys.argv[3]) if len(sys.argv) > 3 else 100
+churn = float(sys.argv[4]) if len(sys.argv) > 4 else 0.01
+rename = float(sys.argv[5]) if len(sys.argv) > 5 else 0.005
+flap = float(sys.argv[6]) if len(sys.argv) > 6 else 0.01
+
+os.makedirs(directory, exist_ok=True)
+
+network = benchutil.SyntheticNetwork(num_nodes, churn, rename, flap, interval=config.UPDATE_INTERVAL)
+for i in range(num_snapshots):
+	if i > 0:
+		network.step()
+
+	with open(os.path.join(directory, 'nodes-{:06d}.json'.format(i)), 'wb') as f:
+		f.write(network.body())
+
+print("Wrote {} snapshots of {} nodes to {}.".format(num_snapshots, num_nodes, directory))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# vim: noexpandtab ts=2 sw=2 sts=2
+
+# measures writing the CSV logs for one cycle: the previous per-line
+# open()/write()/close() approach against LogWriter
+#
+# usage: bench/logwriter.py [num_nodes] [churn]
+
+import contextlib
+import os
+import random
+import sys
+import time
+
+import benchutil
+
+config = benchutil.load_config()
+
+import freifunk_bot
+
+num_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+churn = float(sys.argv[2]) if len(sys.argv) > 2 else 0.3
+
+class SyntheticNode(freifunk_bot.Node):
+	def __init__(self, i, clients):
+		self.nid = benchutil.synthetic_mac(i)
+		self.name = 'node-{}'.format(i)
+		self.online = True
+		self.clients = clients
+		self.max_clients = clients
+		self.max_clients_timestamp = 0
+		self.delete_counter = 0
+
+# previous implementation of the per-node part of log_network_changes
+def log_per_line(current_nodes, known_nodes, new_nodes, gone_nodes):
+	for nid in set(current_nodes.keys()) | set(known_nodes.keys()):
+		clientcount = -1
+		if nid in new_nodes:
+			clientcount = current_nodes[nid].clients
+		elif nid in gone_nodes:
+			clientcount = 0
+		elif known_nodes[nid].clients != current_nodes[nid].clients:
+			clientcount = current_nodes[nid].clients
+
+		if clientcount >= 0:
+			with open(config.LOG_NODECLIENTCOUNT, 'a') as logfile:
+				print("Number of clients for node {} changed: {}".format(nid, clientcount))
+				logfile.write("{} {} {}\n".format(int(time.time()), nid, clientcount))
+
+random.seed(1)
+known_nodes = {}
+for i in range(num_nodes):
+	node = SyntheticNode(i, random.randint(0, 20))
+	known_nodes[node.nid] = node
+
+# churn: part of the nodes disappears, the same number of new nodes appears and
+# the client count changes for the rest of the affected nodes
+affected = random.sample(list(known_nodes.keys()), int(num_nodes * churn))
+gone_nodes = affected[:len(affected) // 4]
+current_nodes = {nid: node for nid, node in known_nodes.items() if nid not in gone_nodes}
+for nid in affected[len(affected) // 4:]:
+	node = current_nodes[nid]
+	current_nodes[nid] = SyntheticNode(int(nid.replace(':', ''), 16), node.clients + 1)
+new_nodes = []
+for i in range(num_nodes, num_nodes + len(gone_nodes)):
+	node = SyntheticNode(i, random.randint(0, 20))
+	current_nodes[node.nid] = node
+	new_nodes.append(node.nid)
+
+old = freifunk_bot.NetworkSnapshot(known_nodes)
+snap = freifunk_bot.NetworkSnapshot(current_nodes)
+
+bot = benchutil.make_bot([b''])
+community = bot.communities[0]
+# only measure the logs, not the broadcast events
+community.eventHandler.sendBroadcast = lambda eventDict: None
+
+changes = freifunk_bot.ChangeSet(known_nodes, current_nodes)
+changes.deleted = changes.gone
+
+with contextlib.redirect_stdout(open(os.devnull, 'w')):
+	start = time.perf_counter()
+	log_per_line(current_nodes, known_nodes, new_nodes, gone_nodes)
+	per_line = time.perf_counter() - start
+
+	# create the node name log first, so both runs only append
+	community.log_network_changes(old, snap, known_nodes, changes)
+
+	start = time.perf_counter()
+	community.log_network_changes(old, snap, known_nodes, changes)
+	batched = time.perf_counter() - start
+
+lines = len(affected) + len(new_nodes)
+print("{} nodes, {} changed client counts per cycle".format(num_nodes, lines))
+print("per-line open/write/close: {:.3f} s".format(per_line))
+print("LogWriter:                 {:.3f} s".format(batched))
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# vim: noexpandtab ts=2 sw=2 sts=2
+
+# measures node lookups through NodeIndex and compares them with a linear scan
+#
+# usage: bench/lookup.py [num_nodes ...]
+
+import random
+import sys
+import time
+
+import benchutil
+
+config = benchutil.load_config()
+
+import freifunk_bot
+
+class SyntheticNode:
+	def __init__(self, i):
+		self.nid = benchutil.synthetic_mac(i)
+		self.name = 'Freifunk-{:06d}-{}'.format(i, random.choice(['Kueche', 'Dach', 'Garten', 'Buero']))
+
+def linear_find(nodes, identifier):
+	for node in nodes.values():
+		if node.name == identifier or node.nid == identifier:
+			return node
+	return None
+
+def timeit(func, identifiers):
+	start = time.perf_counter()
+	for identifier in identifiers:
+		func(identifier)
+	return (time.perf_counter() - start) / len(identifiers)
+
+sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 50000]
+
+print("{:>8} {:>12} {:>12} {:>12} {:>12} {:>12} {:>12}".format(
+	'nodes', 'build [s]', 'linear [us]', 'name [us]', 'mac [us]', 'prefix [us]', 'suggest [us]'))
+
+for size in sizes:
+	random.seed(size)
+	nodes = {}
+	for i in range(size):
+		node = SyntheticNode(i)
+		nodes[node.nid] = node
+
+	index = freifunk_bot.NodeIndex()
+	start = time.perf_counter()
+	index.update(nodes.values(), [], [])
+	build = time.perf_counter() - start
+
+	sample = random.sample(list(nodes.values()), 200)
+	names = [node.name for node in sample]
+	macs = [node.nid for node in sample]
+	prefixes = [node.name[:16].lower() for node in sample]
+	typos = [node.name[:12] + 'x' for node in sample]
+
+	print("{:8d} {:12.3f} {:12.1f} {:12.1f} {:12.1f} {:12.1f} {:12.1f}".format(
+		size, build,
+		timeit(lambda identifier: linear_find(nodes, identifier), names[:20]) * 1e6,
+		timeit(index.find, names) * 1e6,
+		timeit(index.find, macs) * 1e6,
+		timeit(index.find, prefixes) * 1e6,
+		timeit(index.suggest, typos) * 1e6))
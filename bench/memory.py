@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# vim: noexpandtab ts=2 sw=2 sts=2
+
+# measures the memory held by the bot's node state and the memory allocated per
+# update cycle with tracemalloc, using nodes generated from test/nodes.json
+#
+# usage: bench/memory.py [num_nodes] [changed fraction per cycle]
+
+import contextlib
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import benchutil
+
+config = benchutil.load_config()
+
+num_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+churn = float(sys.argv[2]) if len(sys.argv) > 2 else 0.1
+num_cycles = 10
+
+random.seed(num_nodes)
+doc = benchutil.scale_nodes_json(num_nodes)
+entries = list(doc['nodes'].values())
+
+bodies = []
+for i in range(num_cycles + 2):
+	for node in random.sample(entries, int(len(entries) * churn)):
+		node['statistics']['clients'] = random.randint(0, 30)
+	bodies.append(json.dumps(doc).encode('utf-8'))
+
+# time spent in garbage collection
+gc_time = 0.0
+gc_start = 0.0
+
+def gc_callback(phase, info):
+	global gc_time, gc_start
+	if phase == 'start':
+		gc_start = time.perf_counter()
+	else:
+		gc_time += time.perf_counter() - gc_start
+
+with contextlib.redirect_stdout(open(os.devnull, 'w')):
+	tracemalloc.start()
+
+	bot = benchutil.make_bot(bodies)
+	bot.do_freifunk_cycle()
+	bot.do_freifunk_cycle()
+
+	gc.collect()
+	retained = tracemalloc.get_traced_memory()[0]
+
+	gc.callbacks.append(gc_callback)
+
+	cycle_peaks = []
+	for i in range(num_cycles):
+		before = tracemalloc.get_traced_memory()[0]
+		tracemalloc.reset_peak()
+		bot.do_freifunk_cycle()
+		cycle_peaks.append(tracemalloc.get_traced_memory()[1] - before)
+
+	gc.callbacks.remove(gc_callback)
+	gc.collect()
+	final = tracemalloc.get_traced_memory()[0]
+
+	tracemalloc.stop()
+
+print("{} nodes, {:.0f} % changed per cycle".format(num_nodes, churn * 100))
+print("retained after startup:  {:8.2f} MiB".format(retained / 2**20))
+print("retained after cycles:   {:8.2f} MiB".format(final / 2**20))
+print("peak allocated / cycle:  {:8.2f} MiB (median of {})".format(sorted(cycle_peaks)[num_cycles // 2] / 2**20, num_cycles))
+print("time in gc:              {:8.3f} s".format(gc_time))
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# vim: noexpandtab ts=2 sw=2 sts=2
+
+# compares the full json.loads() parse of nodes.json with the streaming parser
+#
+# usage: bench/parse.py [num_nodes ...]
+
+import json
+import sys
+import time
+import tracemalloc
+
+import benchutil
+
+config = benchutil.load_config()
+
+import freifunk_bot
+
+def measure(body, streaming):
+	config.JSON_STREAMING_PARSE = streaming
+
+	tracemalloc.start()
+	start = time.perf_counter()
+	nodes = freifunk_bot.parse_nodes(body)
+	duration = time.perf_counter() - start
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	return len(nodes), duration, peak
+
+sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 50000]
+
+print("{:>8} {:>10} {:>12} {:>12} {:>12} {:>12}".format(
+	'nodes', 'body [MB]', 'full [s]', 'full [MB]', 'stream [s]', 'stream [MB]'))
+
+for size in sizes:
+	body = json.dumps(benchutil.scale_nodes_json(size)).encode('utf-8')
+
+	full = measure(body, False)
+	stream = measure(body, True)
+	assert full[0] == stream[0]
+
+	print("{:8d} {:10.1f} {:12.3f} {:12.1f} {:12.3f} {:12.1f}".format(
+		size, len(body) / 1e6,
+		full[1], full[2] / 1e6,
+		stream[1], stream[2] / 1e6))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# vim: noexpandtab ts=2 sw=2 sts=2
+
+# compares the previous per-sample Python implementation of limitdata() and the
+# min/avg/max binning in plot_minmax() with the NumPy version, on a synthetic
+# multi-year client count log
+#
+# usage: bench/plot_binning.py [years] [sample_interval]
+
+import os
+import sys
+import time
+
+import numpy as np
+
+import benchutil
+
+config = benchutil.load_config()
+
+sys.path.append(os.path.join(benchutil.BASEDIR, 'plot'))
+import network
+
+years = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+interval = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+
+def old_limitdata(timestamp, data, maxage):
+	out_timestamp = []
+	out_data = []
+
+	for i in range(len(timestamp)):
+		if timestamp[i] > (time.time() - maxage):
+			out_timestamp.append(timestamp[i])
+			out_data.append(data[i])
+
+	return out_timestamp, out_data
+
+def old_bin_minmax(timestamp, ydata, binsize):
+	tsbins = np.multiply(np.floor(np.divide(timestamp, binsize)), binsize)
+
+	bins = {}
+	for i in range(len(timestamp)):
+		if tsbins[i] not in bins.keys():
+			bins[ tsbins[i] ] = [ ydata[i] ]
+		else:
+			bins[ tsbins[i] ].append(ydata[i])
+
+	sorted_ts = sorted(tsbins)
+
+	binsdata = {}
+	for ts, data in bins.items():
+		binsdata[ts] = (min(data), np.mean(data), max(data))
+
+	binsdata_ordered = {'min': [], 'avg': [], 'max': []}
+	for k in sorted_ts:
+		binsdata_ordered['min'].append(binsdata[k][0])
+		binsdata_ordered['avg'].append(binsdata[k][1])
+		binsdata_ordered['max'].append(binsdata[k][2])
+
+	return sorted_ts, binsdata_ordered
+
+# the aggregation work done by plot_limited() for the four windows
+def old_pipeline(timestamp, ydata):
+	for maxage, binsize in [(356*24*3600, config.PLOT_ACC_TIME_1Y), (30*24*3600, config.PLOT_ACC_TIME_30D)]:
+		old_bin_minmax(*old_limitdata(timestamp, ydata, maxage), binsize)
+	for maxage in [24*3600, 3*3600]:
+		old_limitdata(timestamp, ydata, maxage)
+
+def new_pipeline(timestamp, ydata):
+	timestamp = np.asarray(timestamp)
+	ydata = np.asarray(ydata)
+	for maxage, binsize in [(356*24*3600, config.PLOT_ACC_TIME_1Y), (30*24*3600, config.PLOT_ACC_TIME_30D)]:
+		network.bin_minmax(*network.limitdata(timestamp, ydata, maxage), binsize)
+	for maxage in [24*3600, 3*3600]:
+		network.limitdata(timestamp, ydata, maxage)
+
+# a random walk of client counts
+rng = np.random.default_rng(1)
+end = int(time.time())
+timestamp = list(range(end - int(years * 365 * 86400), end, interval))
+ydata = list(np.clip(np.cumsum(rng.integers(-1, 2, len(timestamp))), 0, None) % 50)
+
+print("{} samples over {} years".format(len(timestamp), years))
+
+start = time.perf_counter()
+new_pipeline(timestamp, ydata)
+print("NumPy:  {:.3f} s".format(time.perf_counter() - start))
+
+start = time.perf_counter()
+old_pipeline(timestamp, ydata)
+print("Python: {:.3f} s".format(time.perf_counter() - start))
+
+# both must produce the same bins
+old_ts, old_bins = old_bin_minmax(*old_limitdata(timestamp, ydata, 30*24*3600), config.PLOT_ACC_TIME_30D)
+new_ts, binmin, binavg, binmax = network.bin_minmax(
+	*network.limitdata(np.asarray(timestamp), np.asarray(ydata), 30*24*3600), config.PLOT_ACC_TIME_30D)
+
+old_ts, first = np.unique(old_ts, return_index=True)
+assert np.array_equal(old_ts, new_ts)
+assert np.array_equal(np.array(old_bins['min'])[first], binmin)
+assert np.allclose(np.array(old_bins['avg'])[first], binavg)
+assert np.array_equal(np.array(old_bins['max'])[first], binmax)
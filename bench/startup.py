@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# vim: noexpandtab ts=2 sw=2 sts=2
+
+# measures the time from startup to the first cycle that reports changes, with
+# and without a checkpoint of the previous run
+#
+# usage: bench/startup.py [num_nodes]
+
+import contextlib
+import json
+import os
+import sys
+import time
+
+import benchutil
+
+config = benchutil.load_config()
+
+num_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+doc = benchutil.scale_nodes_json(num_nodes)
+bodies = [json.dumps(doc).encode('utf-8')]
+# the network after the restart: every node has one more client
+for node in doc['nodes'].values():
+	node['statistics']['clients'] += 1
+changed_body = json.dumps(doc).encode('utf-8')
+
+def startup(cycles):
+	start = time.perf_counter()
+	bot = benchutil.make_bot(cycles)
+	for i in range(len(cycles)):
+		bot.do_freifunk_cycle()
+	duration = time.perf_counter() - start
+
+	bot.communities[0].close()
+	return bot, duration
+
+checkpoint_file = config.CHECKPOINT_FILE
+
+with contextlib.redirect_stdout(open(os.devnull, 'w')):
+	# without a checkpoint the first cycle only initializes, changes are
+	# reported by the second one
+	config.CHECKPOINT_FILE = None
+	bot, cold = startup([bodies[0], changed_body])
+
+	# run once to write the checkpoint, then restart
+	config.CHECKPOINT_FILE = checkpoint_file
+	startup(bodies)
+	bot, warm = startup([changed_body])
+
+print("{} nodes".format(num_nodes))
+print("without checkpoint: {:.3f} s + {} s UPDATE_INTERVAL until the first diffing cycle".format(
+	cold, config.UPDATE_INTERVAL))
+print("with checkpoint:    {:.3f} s ({} bytes)".format(warm, os.path.getsize(checkpoint_file)))
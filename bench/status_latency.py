@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# vim: noexpandtab ts=2 sw=2 sts=2
+
+# measures the latency of !status while update cycles are running
+#
+# usage: bench/status_latency.py [num_nodes]
+
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+
+import benchutil
+
+config = benchutil.load_config()
+
+num_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+doc = benchutil.scale_nodes_json(num_nodes)
+bodies = [json.dumps(doc).encode('utf-8')]
+# second document: every node has one more client, so every cycle has work to do
+for node in doc['nodes'].values():
+	node['statistics']['clients'] += 1
+bodies.append(json.dumps(doc).encode('utf-8'))
+
+bot = benchutil.make_bot(bodies)
+
+def measure(running):
+	latencies = []
+	while running():
+		start = time.perf_counter()
+		bot.handle_message('!status', '#bench', True)
+		latencies.append(time.perf_counter() - start)
+		time.sleep(0.001)
+
+	latencies.sort()
+	return latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)], latencies[-1]
+
+def run_cycles(count):
+	for i in range(count):
+		bot.do_freifunk_cycle()
+
+# the bot prints every command and log line, keep that out of the measurement
+with contextlib.redirect_stdout(open(os.devnull, 'w')):
+	bot.do_freifunk_cycle()
+
+	end = time.perf_counter() + 1.0
+	idle = measure(lambda: time.perf_counter() < end)
+
+	cycles = threading.Thread(target=run_cycles, args=(3,))
+	start = time.perf_counter()
+	cycles.start()
+	busy = measure(cycles.is_alive)
+	duration = time.perf_counter() - start
+
+print("idle:          median {:.6f} s, p99 {:.6f} s, max {:.6f} s".format(*idle))
+print("during cycles: median {:.6f} s, p99 {:.6f} s, max {:.6f} s".format(*busy))
+print("(3 cycles with {} nodes took {:.2f} s)".format(num_nodes, duration))
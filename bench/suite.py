@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# vim: noexpandtab ts=2 sw=2 sts=2
+
+# times the update cycle end to end against a local HTTP stand-in for the map
+# server, for synthetic networks of several sizes generated from test/nodes.json,
+# together with its stages (from the bot's cycle metrics) and the rendering of
+# !top and !nodes. The results can be written as JSON and compared between
+# commits with bench/compare.py.
+#
+# usage: bench/suite.py [--sizes 1000,10000,100000] [--cycles N] [--churn F]
+#                       [--rename F] [--flap F] [--clients F] [--json FILE]
+
+import argparse
+import contextlib
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import benchutil
+
+config = benchutil.load_config()
+
+import freifunk_bot
+
+parser = argparse.ArgumentParser(description="Benchmark the update cycle on synthetic networks.")
+parser.add_argument('--sizes', default='1000,10000,100000', help="comma-separated numbers of nodes")
+parser.add_argument('--cycles', type=int, default=5, help="timed cycles per size")
+parser.add_argument('--churn', type=float, default=0.01, help="fraction of nodes replaced per cycle")
+parser.add_argument('--rename', type=float, default=0.005, help="fraction of nodes renamed per cycle")
+parser.add_argument('--flap', type=float, default=0.01, help="fraction of nodes changing their online status per cycle")
+parser.add_argument('--clients', type=float, default=0.2, help="fraction of nodes with a new client count per cycle")
+parser.add_argument('--json', help="write the results to this file ('-': stdout)")
+args = parser.parse_args()
+
+COMMANDS = ['!top 10', '!nodes']
+COMMAND_RUNS = 5
+
+# a lot of messages are rendered at once, none of them must be dropped
+config.OUTBOUND_QUEUE_LIMIT = 1 << 30
+# every cycle is waited for, no matter how long it takes
+config.CYCLE_DEADLINE = 3600
+
+def summary(samples):
+	samples = sorted(samples)
+	return {'median': samples[len(samples) // 2], 'min': samples[0], 'max': samples[-1]}
+
+def git_revision():
+	try:
+		revision = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=benchutil.BASEDIR,
+			capture_output=True, text=True, check=True).stdout.strip()
+		dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=benchutil.BASEDIR,
+			capture_output=True, text=True, check=True).stdout.strip()
+		return revision + ('-dirty' if dirty else '')
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def run_size(num_nodes):
+	workdir = os.path.join(config.BENCH_WORKDIR, str(num_nodes))
+	benchutil.redirect_paths(config, workdir)
+
+	# the documents are generated up front and served from files, so neither the
+	# generator nor all documents at once are part of the measurement
+	network = benchutil.SyntheticNetwork(num_nodes, args.churn, args.rename, args.flap, args.clients)
+	paths = []
+	for i in range(args.cycles + 1):
+		if i > 0:
+			network.step()
+		path = os.path.join(workdir, 'nodes-{}.json'.format(i))
+		with open(path, 'wb') as f:
+			f.write(network.body())
+		paths.append(path)
+	body_size = os.path.getsize(paths[-1])
+	del network
+
+	config.JSON_URI, server = benchutil.start_server(paths)
+
+	with contextlib.redirect_stdout(open(os.devnull, 'w')):
+		bot = benchutil.make_bot()
+		community = bot.communities[0]
+
+		start = time.perf_counter()
+		bot.do_freifunk_cycle()
+		initial = time.perf_counter() - start
+
+		cycles = []
+		stages = {phase: [] for phase in freifunk_bot.CycleMetrics.PHASES}
+		for i in range(args.cycles):
+			counts = {phase: h['count'] for phase, h in community.metrics.stats()['phases'].items()}
+
+			start = time.perf_counter()
+			bot.do_freifunk_cycle()
+			cycles.append(time.perf_counter() - start)
+
+			for phase, histogram in community.metrics.stats()['phases'].items():
+				if histogram['count'] > counts[phase]:
+					stages[phase].append(histogram['last'])
+
+		commands = {}
+		for command in COMMANDS:
+			samples = []
+			for i in range(COMMAND_RUNS):
+				start = time.perf_counter()
+				bot.handle_message(command, 'bench', False)
+				samples.append(time.perf_counter() - start)
+
+				messages = bot.outboundQueue.metrics()['depth']
+				bot.outboundQueue.drain()
+			commands[command] = dict(summary(samples), messages=messages)
+
+	counters = community.metrics.stats()['counters']
+
+	server.shutdown()
+	server.server_close()
+	community.close()
+	bot.pool.shutdown()
+
+	return {'nodes': num_nodes,
+	        'body_bytes': body_size,
+	        'initial_cycle': initial,
+	        'cycle': summary(cycles),
+	        'stages': {phase: summary(samples) for phase, samples in stages.items() if samples},
+	        'commands': commands,
+	        'counters': counters}
+
+results = []
+for num_nodes in [int(size) for size in args.sizes.split(',')]:
+	result = run_size(num_nodes)
+	results.append(result)
+	gc.collect()
+
+	print("{} nodes ({:.1f} MB nodes.json), first cycle {:.3f} s".format(
+		num_nodes, result['body_bytes'] / 1e6, result['initial_cycle']))
+	print("  {:15} median {:8.4f} s, max {:8.4f} s".format('do_freifunk_cycle', result['cycle']['median'], result['cycle']['max']))
+	for phase, stage in result['stages'].items():
+		print("  {:15} median {:8.4f} s, max {:8.4f} s".format(phase, stage['median'], stage['max']))
+	for command, stage in result['commands'].items():
+		print("  {:15} median {:8.4f} s, max {:8.4f} s ({} messages)".format(
+			command, stage['median'], stage['max'], stage['messages']))
+
+report = {'revision': git_revision(),
+          'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+          'python': platform.python_version(),
+          'machine': platform.machine(),
+          'cpus': os.cpu_count(),
+          'parameters': {'cycles': args.cycles, 'churn': args.churn, 'rename': args.rename,
+                         'flap': args.flap, 'clients': args.clients,
+                         'streaming_parse': config.JSON_STREAMING_PARSE},
+          'results': results}
+
+if args.json == '-':
+	json.dump(report, sys.stdout, indent=1)
+	print()
+elif args.json:
+	with open(args.json, 'w') as f:
+		json.dump(report, f, indent=1)
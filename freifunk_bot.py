@@ -2,133 +2,618 @@
 # vim: noexpandtab ts=2 sw=2 sts=2
 
 import irc.client
+import asyncio
 import requests
+import urllib3.util.request
 import time
 import sys
 import os
 import threading
 import sqlite3
+import copy
+import bisect
+import difflib
+import heapq
+import collections
+import concurrent.futures
+import errno
+import fcntl
+import hashlib
+import http.server
 import json
+import re
+import traceback
 
 import config
+import tsstore
+
+# Messages to the IRC server are queued here and sent from the reactor thread,
+# limited by a token bucket: up to RATELIMIT_MESSAGES messages at once, then one
+# message per RATELIMIT_INTERVAL. Threads putting messages never block.
+class OutboundQueue:
+	PRIORITY_NOTICE  = 0
+	PRIORITY_PUBLIC  = 1
+	PRIORITY_PRIVATE = 2
 
-class Ratelimiter:
 	def __init__(self):
-		self.ratelimitMessages = 0
-		self.nextMessageTime = 0
+		self.lock = threading.Lock()
+		self.connection = None
+
+		# heap of (priority, sequence number, enqueue time, method, target, message)
+		self.queue = []
+		self.sequence = 0
+
+		self.tokens = config.RATELIMIT_MESSAGES
+		self.lastRefill = time.monotonic()
+
+		# map of target => number of messages to it dropped since the last notice
+		self.droppedTargets = {}
+
+		# metrics
+		self.sentMessages = 0
+		self.droppedMessages = 0
+		self.totalWaitTime = 0.0
+		self.maxWaitTime = 0.0
+
+	def setConnection(self, conn):
+		self.connection = conn
+
+	# method is the name of the ServerConnection method used to send the message
+	def put(self, method, target, message, priority):
+		with self.lock:
+			entry = (priority, self.sequence, time.monotonic(), method, target, message)
+			self.sequence += 1
+
+			if len(self.queue) >= config.OUTBOUND_QUEUE_LIMIT:
+				# drop the newest message with the lowest priority, which may be this one
+				worst = max(self.queue)
+				if entry > worst:
+					worst = entry
+				else:
+					self.queue.remove(worst)
+					heapq.heapify(self.queue)
+
+				self.droppedMessages += 1
+				target = worst[4]
+				self.droppedTargets[target] = self.droppedTargets.get(target, 0) + 1
+
+				if entry is worst:
+					return
+
+			heapq.heappush(self.queue, entry)
+
+	# sends as many messages as the token bucket allows. Called by the reactor's scheduler.
+	def drain(self):
+		now = time.monotonic()
+
+		with self.lock:
+			self.tokens = min(config.RATELIMIT_MESSAGES,
+				self.tokens + (now - self.lastRefill) / config.RATELIMIT_INTERVAL)
+			self.lastRefill = now
+
+			while self.queue and self.tokens >= 1 and self.connection:
+				entry = heapq.heappop(self.queue)
+				priority, sequence, enqueued, method, target, message = entry
+
+				try:
+					getattr(self.connection, method)(target, message)
+				except irc.client.ServerNotConnectedError:
+					# keep the message until the connection is back
+					heapq.heappush(self.queue, entry)
+					break
+
+				self.tokens -= 1
+
+				wait = now - enqueued
+				self.sentMessages += 1
+				self.totalWaitTime += wait
+				self.maxWaitTime = max(self.maxWaitTime, wait)
+
+			# once there is room again, tell the recipients that messages are missing.
+			# The notice is queued after everything else, so it ends the reply.
+			if self.droppedTargets and len(self.queue) < config.OUTBOUND_QUEUE_LIMIT // 2:
+				for target, count in self.droppedTargets.items():
+					print("Outbound queue was full, dropped {} messages to {}".format(count, target))
+					entry = (OutboundQueue.PRIORITY_PRIVATE, self.sequence, now, 'privmsg', target,
+						"Die Ausgabe wurde gekürzt, {} Zeilen wurden verworfen.".format(count))
+					self.sequence += 1
+					heapq.heappush(self.queue, entry)
+				self.droppedTargets = {}
+
+	def metrics(self):
+		with self.lock:
+			return {'depth': len(self.queue),
+			        'sent': self.sentMessages,
+			        'dropped': self.droppedMessages,
+			        'avg_wait': self.totalWaitTime / self.sentMessages if self.sentMessages else 0.0,
+			        'max_wait': self.maxWaitTime}
+
+class NodesFetcher:
+	def __init__(self, uri):
+		self.uri = uri
+
+		# keep one session, so the connection to the map server is reused
+		self.session = requests.Session()
+		# advertise every content coding urllib3 can decode (br only if brotli is installed)
+		self.session.headers['Accept-Encoding'] = urllib3.util.request.ACCEPT_ENCODING
+
+		# validators of the last applied body
+		self.etag = None
+		self.last_modified = None
+		self.body_hash = None
+		# validators of the last fetched body until it is applied, see commit()
+		self.pending = None
+
+		# counters for the last cycle
+		self.bytes_transferred = 0
+		self.latency = 0.0
+
+		# counters since startup
+		self.total_bytes_transferred = 0
+		self.skipped_cycles = 0
+
+	# returns the body of nodes.json, or None if it did not change since the last fetch
+	def fetch(self):
+		headers = {}
+		if self.etag:
+			headers['If-None-Match'] = self.etag
+		if self.last_modified:
+			headers['If-Modified-Since'] = self.last_modified
+
+		start = time.monotonic()
+		r = self.session.get(self.uri, headers=headers, timeout=config.REQUEST_TIMEOUT)
+		body = r.content
+		self.latency = time.monotonic() - start
+
+		# number of (possibly compressed) bytes read from the socket
+		self.bytes_transferred = r.raw.tell() if r.raw else len(body)
+		self.total_bytes_transferred += self.bytes_transferred
+
+		if r.status_code == 304:
+			self.skipped_cycles += 1
+			return None
 
-	def ratelimit(self):
-		now = time.time()
+		r.raise_for_status()
 
-		if now < self.nextMessageTime:
-			# bot is sending too fast
-			self.ratelimitMessages += 1
+		validators = (r.headers.get('ETag'), r.headers.get('Last-Modified'), hashlib.sha1(body).digest())
 
-			print("RATELIMITER: {} messages too fast.".format(self.ratelimitMessages))
+		# servers without validators still deliver the same file until it is regenerated
+		if validators[2] == self.body_hash:
+			self.etag, self.last_modified = validators[:2]
+			self.skipped_cycles += 1
+			return None
 
-			if self.ratelimitMessages > config.RATELIMIT_MESSAGES:
-				time.sleep(self.nextMessageTime - now)
+		self.pending = validators
+		return body
+
+	# marks the body returned by the last fetch as applied. A body that was not
+	# applied, e.g. because its cycle was aborted, is fetched again next time.
+	def commit(self):
+		if self.pending:
+			self.etag, self.last_modified, self.body_hash = self.pending
+			self.pending = None
+
+	def stats(self):
+		return {'bytes': self.bytes_transferred,
+		        'latency': self.latency,
+		        'total_bytes': self.total_bytes_transferred,
+		        'skipped_cycles': self.skipped_cycles}
+
+# Collects the per-node notices of one cycle. If more than NOTIFY_COALESCE_THRESHOLD
+# notices of one kind occur, a single summary is sent instead. Within
+# NOTIFY_FLAP_WINDOW seconds after a status change of a node was announced, its
+# further changes are held back; when the window has passed, the node's settled
+# status is announced if it differs from the announced one.
+class NoticeCoalescer:
+	SUMMARIES = {
+		'new':       "{:d} neue Knoten",
+		'deleted':   "{:d} Knoten gelöscht",
+		'renamed':   "{:d} Knoten umbenannt",
+		'online':    "{:d} Knoten online",
+		'offline':   "{:d} Knoten offline",
+		'highscore': "{:d} Knoten mit neuem Client-Highscore",
+	}
+
+	def __init__(self):
+		# map of kind => list of (node, message)
+		self.pending = {}
+		# map of id => (announced status, timestamp of the announcement)
+		self.announcedStatus = {}
+		# map of id => (kind, node, message) of status changes held back
+		self.heldStatus = {}
+
+	def add(self, kind, node, message):
+		self.pending.setdefault(kind, []).append( (node, message) )
+
+	# announces a status change, unless the last one of the node was announced
+	# less than NOTIFY_FLAP_WINDOW seconds ago
+	def addStatusChange(self, node, timestamp, message):
+		kind = 'online' if node.online else 'offline'
+
+		announced = self.announcedStatus.get(node.nid)
+		if announced is None or timestamp - announced[1] >= config.NOTIFY_FLAP_WINDOW:
+			self.announcedStatus[node.nid] = (node.online, timestamp)
+			self.heldStatus.pop(node.nid, None)
+			self.add(kind, node, message)
+		elif node.online == announced[0]:
+			# back to the announced status, there is nothing to tell
+			self.heldStatus.pop(node.nid, None)
 		else:
-			self.ratelimitMessages = 0
+			self.heldStatus[node.nid] = (kind, node, message)
+
+	# the node is gone, its held back status is not announced anymore
+	def forget(self, nid):
+		self.announcedStatus.pop(nid, None)
+		self.heldStatus.pop(nid, None)
+
+	# returns the notices to send for this cycle
+	def flush(self, timestamp):
+		# announce the settled status of nodes whose window has passed
+		for nid, (kind, node, message) in list(self.heldStatus.items()):
+			if timestamp - self.announcedStatus[nid][1] >= config.NOTIFY_FLAP_WINDOW:
+				del self.heldStatus[nid]
+				self.announcedStatus[nid] = (node.online, timestamp)
+				self.add(kind, node, message)
+
+		messages = []
+		for kind in sorted(self.pending.keys()):
+			entries = self.pending[kind]
+			if len(entries) <= config.NOTIFY_COALESCE_THRESHOLD:
+				messages.extend(message for node, message in entries)
+				continue
+
+			# name the most important nodes, judged by their client highscore
+			nodes = sorted((node for node, message in entries), key=lambda n: n.max_clients, reverse=True)
+			names = [node.readableName() for node in nodes[:config.NOTIFY_COALESCE_TOP]]
+			if len(nodes) > config.NOTIFY_COALESCE_TOP:
+				names.append("…")
+
+			messages.append("{} (Top: {})".format(self.SUMMARIES[kind].format(len(entries)), ", ".join(names)))
+
+		self.pending = {}
+
+		# forget announcements that are too old to matter
+		for nid, (online, last) in list(self.announcedStatus.items()):
+			if timestamp - last >= config.NOTIFY_FLAP_WINDOW:
+				del self.announcedStatus[nid]
+
+		return messages
+
+# Non-blocking writer for the distserv FIFO. Data that cannot be written yet is
+# kept in a backlog of at most BROADCAST_BACKLOG_LIMIT bytes; older batches are
+# dropped when it overflows. The FIFO is (re)opened whenever data is written, so
+# distserv may be started or restarted at any time.
+class BroadcastFIFO:
+	def __init__(self, path):
+		self.path = path
+		self.fd = None
+
+		# deque of [data, number of events]
+		self.backlog = collections.deque()
+		self.backlogSize = 0
+		# number of bytes of the first backlog entry that were already written
+		self.headWritten = 0
+
+		self.droppedEvents = 0
+
+	def _open(self):
+		try:
+			# fails with ENXIO if no process has the FIFO open for reading
+			self.fd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+		except OSError as e:
+			if e.errno not in (errno.ENXIO, errno.ENOENT):
+				print("Cannot open broadcast FIFO: {}".format(str(e)))
+			self.fd = None
+
+	def _close(self):
+		os.close(self.fd)
+		self.fd = None
+
+		# a partially written batch cannot be continued on a new reader
+		if self.headWritten:
+			data, count = self.backlog.popleft()
+			self.backlogSize -= len(data)
+			self.droppedEvents += count
+			self.headWritten = 0
+
+	# snap is the network state after these events; distserv has no use for it
+	def write(self, data, count, snap):
+		self.backlog.append([data, count])
+		self.backlogSize += len(data)
+
+		# drop the oldest batches, but never one that is partially written
+		while self.backlogSize > config.BROADCAST_BACKLOG_LIMIT and len(self.backlog) > 1:
+			index = 1 if self.headWritten else 0
+			data, count = self.backlog[index]
+			del self.backlog[index]
+			self.backlogSize -= len(data)
+			self.droppedEvents += count
+
+		self.drain()
+
+	def drain(self):
+		if self.fd is None:
+			self._open()
+			if self.fd is None:
+				return
+
+		while self.backlog:
+			data, count = self.backlog[0]
+			try:
+				written = os.write(self.fd, data[self.headWritten:])
+			except BlockingIOError:
+				# the reader is too slow, try again with the next batch
+				return
+			except OSError:
+				# the reader went away (EPIPE)
+				self._close()
+				return
+
+			self.headWritten += written
+			if self.headWritten == len(data):
+				self.backlog.popleft()
+				self.backlogSize -= len(data)
+				self.headWritten = 0
+
+	def stats(self):
+		return {'backlog_bytes': self.backlogSize,
+		        'dropped_events': self.droppedEvents}
+
+# Sends events as newline-delimited JSON to TCP subscribers, replacing the FIFO
+# and distserv. Every new subscriber first gets a 'snapshot' line with all known
+# nodes and the network aggregates, followed by the events of later cycles.
+# Subscribers that have more than BROADCAST_CLIENT_BUFFER bytes of unsent data
+# are disconnected. The server runs its own asyncio loop in a separate thread.
+class BroadcastServer:
+	def __init__(self, host, port):
+		self.host = host
+		self.port = port
+
+		self.loop = asyncio.new_event_loop()
+		self.thread = threading.Thread(target=self._run, daemon=True)
+		self.started = threading.Event()
+		# set if the server could not be started
+		self.startError = None
+
+		# the following is only accessed from the loop thread
+		self.clients = set()
+		self.snapshot = None
+		self.snapshotData = None
+
+		self.connectedClients = 0
+		self.disconnectedSlowClients = 0
+
+	# raises the error of the loop thread if the port cannot be bound
+	def start(self):
+		self.thread.start()
+		self.started.wait()
+		if self.startError:
+			raise self.startError
+
+	def _run(self):
+		asyncio.set_event_loop(self.loop)
+		try:
+			self.server = self.loop.run_until_complete(
+				asyncio.start_server(self._handleClient, self.host or None, self.port))
+		except OSError as e:
+			self.startError = e
+			self.started.set()
+			self.loop.close()
+			return
+
+		# the port may have been chosen by the OS
+		self.port = self.server.sockets[0].getsockname()[1]
+		self.started.set()
+
+		self.loop.run_forever()
+
+	def _snapshotData(self):
+		if self.snapshotData is None:
+			snap = self.snapshot
+			eventDict = {'type': 'snapshot',
+			             'nodes': [node.toDict() for node in snap.nodes.values()],
+			             'registered_nodes': snap.num_nodes,
+			             'online_nodes': snap.num_nodes_online,
+			             'clients': snap.num_clients,
+			             'timestamp': snap.timestamp}
+			self.snapshotData = (json.dumps(eventDict) + "\n").encode('utf-8')
 
-		self.nextMessageTime = time.time() + config.RATELIMIT_INTERVAL
+		return self.snapshotData
 
+	async def _handleClient(self, reader, writer):
+		self.connectedClients += 1
+
+		if self.snapshot is not None:
+			writer.write(self._snapshotData())
+		self.clients.add(writer)
+
+		try:
+			# subscribers do not send anything, wait for them to disconnect
+			while await reader.read(1024):
+				pass
+		except ConnectionError:
+			pass
+		finally:
+			self.clients.discard(writer)
+			writer.close()
+
+	def _publish(self, data, snap):
+		if snap is not None:
+			self.snapshot = snap
+			self.snapshotData = None
+
+		for writer in list(self.clients):
+			if writer.transport.get_write_buffer_size() > config.BROADCAST_CLIENT_BUFFER:
+				self.disconnectedSlowClients += 1
+				self.clients.discard(writer)
+				writer.transport.abort()
+			else:
+				writer.write(data)
+
+	def write(self, data, count, snap):
+		self.loop.call_soon_threadsafe(self._publish, data, snap)
+
+	def stats(self):
+		return {'clients': len(self.clients),
+		        'connected_clients': self.connectedClients,
+		        'disconnected_slow_clients': self.disconnectedSlowClients}
+
+# Serves the bot's metrics in the Prometheus text format on /metrics. render is
+# called for every request and returns the text.
+class MetricsServer:
+	def __init__(self, host, port, render):
+		self.httpd = http.server.ThreadingHTTPServer((host, port), MetricsRequestHandler)
+		self.httpd.daemon_threads = True
+		self.httpd.render = render
+
+		# the port may have been chosen by the OS
+		self.port = self.httpd.server_address[1]
+
+		self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+	def start(self):
+		self.thread.start()
+
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+	def do_GET(self):
+		if self.path != '/metrics':
+			self.send_error(404)
+			return
+
+		data = self.server.render().encode('utf-8')
+		self.send_response(200)
+		self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+		self.send_header('Content-Length', str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	# scrapes are not logged
+	def log_message(self, format, *args):
+		pass
+
+# settings is the configuration of the community the events belong to (see
+# CommunitySettings)
 class EventHandler:
-	def __init__(self):
-		self.broadcastFIFO = open(config.DISTSERV_FIFO, 'w')
-		self.fifoOpen = True
+	# broadcast replaces the sink configured in settings, e.g. for replay.py
+	def __init__(self, settings, broadcast=None):
+		self.settings = settings
+
+		if broadcast is not None:
+			self.broadcast = broadcast
+		elif self.settings.BROADCAST_SERVER:
+			self.broadcast = BroadcastServer(self.settings.DISTSERV_HOST, self.settings.DISTSERV_PORT)
+			self.broadcast.start()
+		else:
+			self.broadcast = BroadcastFIFO(self.settings.DISTSERV_FIFO)
+		self.pendingEvents = []
+		self.jsonEncoder = json.JSONEncoder()
 		self.timestamp = time.time()
+		self.coalescer = NoticeCoalescer()
 
 		self.sendBroadcast({'info': 'Startup successful'})
-
-	def setConnection(self, conn):
-		self.connection = conn
+		self.flushBroadcasts()
 
 	def setTarget(self, target):
 		self.target = target
 
-	def setRatelimiter(self, rl):
-		self.ratelimiter = rl
+	def setOutboundQueue(self, queue):
+		self.outboundQueue = queue
 
 	def setTimestamp(self, ts):
 		self.timestamp = ts
 
+	# events are collected and sent by flushBroadcasts() at the end of the cycle
 	def sendBroadcast(self, eventDict):
 		# add a timestamp to all messages
 		eventDict['timestamp'] = self.timestamp
 
-		try:
-			if not self.fifoOpen:
-				# try to reopen the FIFO
-				self.broadcastFIFO = open(config.DISTSERV_FIFO, 'w')
-				self.fifoOpen = True
+		self.pendingEvents.append(eventDict)
+
+	# snap is the network state after the pending events, if it changed. Returns
+	# the number of events and bytes written.
+	def flushBroadcasts(self, snap=None):
+		if not self.pendingEvents and snap is None:
+			return 0, 0
 
-			self.broadcastFIFO.write(json.dumps(eventDict) + "\n")
-			self.broadcastFIFO.flush()
-		except BrokenPipeError:
-			self.fifoOpen = False
+		encode = self.jsonEncoder.encode
+		data = "".join(encode(eventDict) + "\n" for eventDict in self.pendingEvents).encode('utf-8')
+		count = len(self.pendingEvents)
+		self.broadcast.write(data, count, snap)
+
+		self.pendingEvents = []
+		return count, len(data)
 
 	def sendNotice(self, message):
-		self.ratelimiter.ratelimit()
-		self.connection.notice(self.target, message)
+		self.outboundQueue.put('notice', self.target, message, OutboundQueue.PRIORITY_NOTICE)
+
+	# per-node notices are collected and sent by flushNotices() at the end of the cycle
+	def sendNodeNotice(self, kind, node, message):
+		self.coalescer.add(kind, node, message)
+
+	def flushNotices(self):
+		for message in self.coalescer.flush(self.timestamp):
+			self.sendNotice(message)
 
 	# Notifications about Highscores
 	def highscoreRegisteredNodes(self, count):
 		eventDict = {'type': 'registered_nodes', 'highscore': True, 'count': count}
 		self.sendBroadcast(eventDict)
 
-		if config.NOTIFY_NET_HIGHSCORES:
+		if self.settings.NOTIFY_NET_HIGHSCORES:
 			self.sendNotice("Neuer Highscore: {:d} registrierte Knoten!".format(count))
 
 	def highscoreOnlineNodes(self, count):
 		eventDict = {'type': 'online_nodes', 'highscore': True, 'count': count}
 		self.sendBroadcast(eventDict)
 
-		if config.NOTIFY_NET_HIGHSCORES:
+		if self.settings.NOTIFY_NET_HIGHSCORES:
 			self.sendNotice("Neuer Highscore: {:d} Knoten online!".format(count))
 
 	def highscoreOnlineClients(self, count):
 		eventDict = {'type': 'clients', 'highscore': True, 'count': count}
 		self.sendBroadcast(eventDict)
 
-		if config.NOTIFY_NODE_HIGHSCORES:
+		if self.settings.NOTIFY_NODE_HIGHSCORES:
 			self.sendNotice("Neuer Highscore: {:d} Clients verbunden!".format(count))
 
 	def highscoreClientsAtNode(self, node):
 		eventDict = {'type': 'node_clients', 'highscore': True, 'node': node.toDict()}
 		self.sendBroadcast(eventDict)
 
-		if config.NOTIFY_NODE_CLIENT_HIGHSCORES:
-			self.sendNotice("Neuer Highscore: Knoten {:s} hat {:d} Clients!".format(node.readableName(), node.max_clients))
+		if self.settings.NOTIFY_NODE_CLIENT_HIGHSCORES:
+			self.sendNodeNotice('highscore', node,
+				"Neuer Highscore: Knoten {:s} hat {:d} Clients!".format(node.readableName(), node.max_clients))
 
 	# Notifications about Network Changes
 	def newNode(self, node):
 		eventDict = {'type': 'new_node', 'node': node.toDict()}
 		self.sendBroadcast(eventDict)
 
-		if config.NOTIFY_NEW_NODES:
-			self.sendNotice("Neuer Knoten: {:s}".format(node.readableName()))
+		if self.settings.NOTIFY_NEW_NODES:
+			self.sendNodeNotice('new', node, "Neuer Knoten: {:s}".format(node.readableName()))
 
 	def nodeDeleted(self, node):
 		eventDict = {'type': 'node_deleted', 'node': node.toDict()}
 		self.sendBroadcast(eventDict)
+		self.coalescer.forget(node.nid)
 
-		if config.NOTIFY_DELETED_NODES:
-			self.sendNotice("Knoten gelöscht: {:s}".format(node.readableName()))
+		if self.settings.NOTIFY_DELETED_NODES:
+			self.sendNodeNotice('deleted', node, "Knoten gelöscht: {:s}".format(node.readableName()))
 
 	def nodeRenamed(self, node, old_node):
 		eventDict = {'type': 'node_renamed', 'node': node.toDict(), 'node_name_prev': old_node.name}
 		self.sendBroadcast(eventDict)
 
-		if config.NOTIFY_RENAMED_NODES:
-			self.sendNotice("Knoten {:s} heißt jetzt {:s}".format(old_node.readableName(), node.readableName()))
+		if self.settings.NOTIFY_RENAMED_NODES:
+			self.sendNodeNotice('renamed', node,
+				"Knoten {:s} heißt jetzt {:s}".format(old_node.readableName(), node.readableName()))
 
 	def nodeStatusChanged(self, node):
 		eventDict = {'type': 'online_status_changed', 'node': node.toDict()}
 		self.sendBroadcast(eventDict)
 
-		if config.NOTIFY_ONLINE_STATUS:
-			self.sendNotice("{:s} ist jetzt {}".format(
+		if self.settings.NOTIFY_ONLINE_STATUS:
+			self.coalescer.addStatusChange(node, self.timestamp, "{:s} ist jetzt {}".format(
 				node.readableName(),
 				"online" if node.online else "offline"))
 
@@ -149,40 +634,30 @@ class EventHandler:
 		self.sendBroadcast(eventDict)
 
 
+# Nodes are shared between snapshots while they do not change (see parse_nodes()),
+# so a node must not be modified after it was published.
 class Node:
-	def __init__(self, json_obj):
-		self.nid = json_obj['nodeinfo']['network']['mac']
-		self.name = json_obj['nodeinfo']['hostname']
-		self.online = json_obj['flags']['online']
-		self.clients = json_obj['statistics']['clients']
+	__slots__ = ('nid', 'name', 'online', 'clients', 'max_clients', 'max_clients_timestamp', 'delete_counter')
+
+	def __init__(self, nid, name, online, clients):
+		self.nid = nid
+		self.name = name
+		self.online = online
+		self.clients = clients
 		self.max_clients = -1
 		self.max_clients_timestamp = -1
 		self.delete_counter = 0
 
-	def loadMaxClients(self, db):
-		c = db.cursor()
-
-		c.execute('SELECT clients, timestamp FROM node_highscores WHERE id=?', (self.nid,) )
-
-		row = c.fetchone()
-
-		if row:
-			self.max_clients, self.max_clients_timestamp = row
-
-	def saveMaxClients(self, db):
-		c = db.cursor()
-		result = c.execute('INSERT OR REPLACE INTO node_highscores VALUES(?, ?, ?)', (self.nid, self.max_clients, self.max_clients_timestamp) )
-
 	# returns True if a new highscore is reached, False otherwise
-	def updateHighscore(self, db):
+	def updateHighscore(self, highscores, timestamp):
 		if self.max_clients == -1:
-			self.loadMaxClients(db)
+			self.max_clients, self.max_clients_timestamp = highscores.get(self.nid)
 
 		if self.clients > self.max_clients:
 			# new highscore!
 			self.max_clients = self.clients
-			self.max_clients_timestamp = int(time.time())
-			self.saveMaxClients(db)
+			self.max_clients_timestamp = int(timestamp)
+			highscores.set(self.nid, self.max_clients, self.max_clients_timestamp)
 			return True
 		else:
 			return False
@@ -202,16 +677,27 @@ class Node:
 		        'online': self.online,
 		        'clients': self.clients}
 
+	def toCheckpoint(self):
+		return [self.nid, self.name, self.online, self.clients,
+		        self.max_clients, self.max_clients_timestamp, self.delete_counter]
+
+	@staticmethod
+	def fromCheckpoint(record):
+		node = Node.__new__(Node)
+		(node.nid, node.name, node.online, node.clients,
+		 node.max_clients, node.max_clients_timestamp, node.delete_counter) = record
+		return node
+
 class Highscore:
 	def __init__(self, key):
 		self.key       = key
 		self.value     = 0
 		self.timestamp = 0
 
-	def update(self, value):
+	def update(self, value, timestamp):
 		if value > self.value:
 			self.value = value
-			self.timestamp = int(time.time())
+			self.timestamp = int(timestamp)
 			return True
 		else:
 			return False
@@ -229,52 +715,1003 @@ class Highscore:
 		c = db.cursor();
 		c.execute('UPDATE highscores SET value=?, timestamp=? WHERE key=?', (self.value, self.timestamp, self.key) )
 
-class FreifunkBot(irc.client.SimpleIRCClient):
-	def __init__(self, target):
-		irc.client.SimpleIRCClient.__init__(self)
-		self.target = target
+_json_decoder = json.JSONDecoder()
+_json_whitespace = re.compile(r'[ \t\n\r]*')
+
+def _skip_json_char(text, pos, expected):
+	pos = _json_whitespace.match(text, pos).end()
+	if pos >= len(text):
+		raise ValueError("Unexpected end of input at position {}".format(pos))
+	if text[pos] not in expected:
+		raise ValueError("Expected one of {!r} at position {}".format(expected, pos))
+	return text[pos], _json_whitespace.match(text, pos + 1).end()
+
+# walks the members of the JSON object starting at pos and yields (key, value_pos)
+# for each of them. The caller must advance the generator with the end position of
+# the value via send().
+def _iter_json_object(text, pos):
+	char, pos = _skip_json_char(text, pos, '{')
+	if text[pos:pos+1] == '}':
+		return pos + 1
+
+	while True:
+		key, pos = _json_decoder.raw_decode(text, pos)
+		_, pos = _skip_json_char(text, pos, ':')
+		pos = yield key, pos
+		char, pos = _skip_json_char(text, pos, ',}')
+		if char == '}':
+			return pos
+
+# yields the entries of the top-level 'nodes' object one by one. Only a single node
+# entry is decoded at a time, so the full document never exists as Python objects.
+# The other top-level members (timestamp, version) are stored in header if given.
+# Like json.loads() and doc['nodes'], a truncated document, trailing data or a
+# missing 'nodes' member raise ValueError or KeyError.
+def iter_node_entries(text, header=None):
+	members = _iter_json_object(text, 0)
+	found_nodes = False
+	try:
+		key, pos = next(members)
+		while True:
+			if key == 'nodes':
+				found_nodes = True
+				entries = _iter_json_object(text, pos)
+				try:
+					_, entry_pos = next(entries)
+					while True:
+						entry, entry_pos = _json_decoder.raw_decode(text, entry_pos)
+						yield entry
+						_, entry_pos = entries.send(entry_pos)
+				except StopIteration as e:
+					pos = e.value
+			else:
+				value, pos = _json_decoder.raw_decode(text, pos)
+				if header is not None:
+					header[key] = value
+
+			key, pos = members.send(pos)
+	except StopIteration as e:
+		end = e.value
+
+	if _json_whitespace.match(text, end).end() != len(text):
+		raise ValueError("Extra data at position {}".format(end))
+	if not found_nodes:
+		raise KeyError('nodes')
+
+# strings of the nodes are interned, so equal names and ids share one object
+def _intern(value):
+	if type(value) is str:
+		return sys.intern(value)
+	return value
+
+# parses a nodes.json body into a map of id => Node. Nodes of known_nodes are
+# reused if nothing changed, so the nodes and strings of unchanged nodes are not
+# allocated again every cycle. header receives the top-level members of the
+# document other than 'nodes'.
+def parse_nodes(body, known_nodes=None, header=None):
+	if known_nodes is None:
+		known_nodes = {}
+
+	text = body.decode('utf-8')
+
+	if config.JSON_STREAMING_PARSE:
+		entries = iter_node_entries(text, header)
+	else:
+		doc = json.loads(text)
+		entries = doc.pop('nodes').values()
+		if header is not None:
+			header.update(doc)
 
+	nodes = {}
+	for entry in entries:
+		try:
+			nid = entry['nodeinfo']['network']['mac']
+			name = entry['nodeinfo']['hostname']
+			online = entry['flags']['online']
+			clients = entry['statistics']['clients']
+		except KeyError as e:
+			# node is missing relevant information for tracking
+			continue
+
+		n = known_nodes.get(nid)
+		if n is None:
+			n = Node(_intern(nid), _intern(name), online, clients)
+		elif n.name != name or n.online != online or n.clients != clients or n.delete_counter:
+			n = Node(n.nid, _intern(name), online, clients)
+
+		nodes[n.nid] = n
+
+	return nodes
+
+# State of the network after one update cycle. A snapshot is never modified after
+# it was published, so command handlers can read it without any locking.
+class NetworkSnapshot:
+	def __init__(self, nodes, timestamp=0):
 		# map of id => node data
-		self.known_nodes      = {}
-		self.num_clients      = 0
-		self.num_nodes        = 0
+		self.nodes = nodes
+		self.timestamp = timestamp
+
+		self.num_nodes        = len(nodes)
 		self.num_nodes_online = 0
+		self.num_clients      = 0
+		for node in nodes.values():
+			self.num_clients += node.clients
+			if node.online:
+				self.num_nodes_online += 1
+
+# Differences between the nodes of the last and of the current cycle, found in
+# one pass over the current nodes. parse_nodes() hands out the known node object
+# itself if none of the tracked fields changed, so unchanged nodes are skipped by
+# identity and only the few changed ones are compared field by field.
+class ChangeSet:
+	def __init__(self, known_nodes, current_nodes, initial=False):
+		# True if known_nodes is empty because the bot just started
+		self.initial = initial
+
+		# lists of ids
+		self.new = []
+		self.gone = []
+		self.status = []
+		self.renamed = []
+		self.clients = []
+		# nodes gone for DELETE_TIMEOUT cycles, filled in by the bot
+		self.deleted = []
+
+		# new and changed nodes
+		self.updated = []
+
+		for nid, node in current_nodes.items():
+			known = known_nodes.get(nid)
+			if known is node:
+				continue
+
+			self.updated.append(node)
+
+			if known is None:
+				self.new.append(nid)
+				continue
+
+			if known.online != node.online:
+				self.status.append(nid)
+			if known.name != node.name:
+				self.renamed.append(nid)
+			if known.clients != node.clients:
+				self.clients.append(nid)
+
+		# every known node that is still there was matched above
+		if len(current_nodes) - len(self.new) != len(known_nodes):
+			self.gone = list(known_nodes.keys() - current_nodes.keys())
+
+# Client highscores of all nodes. The table is read once at startup and kept in
+# memory; changed entries are written back in one batch per cycle.
+class NodeHighscores:
+	def __init__(self):
+		# map of id => (clients, timestamp)
+		self.scores = {}
+		self.dirty = set()
 
-		self.last_nodes_online = 0
+	def load(self, db):
+		c = db.cursor()
+		for nid, clients, timestamp in c.execute('SELECT id, clients, timestamp FROM node_highscores'):
+			self.scores[nid] = (clients, timestamp)
+
+	def get(self, nid):
+		return self.scores.get(nid, (-1, -1))
+
+	def set(self, nid, clients, timestamp):
+		self.scores[nid] = (clients, timestamp)
+		self.dirty.add(nid)
+
+	def save(self, db):
+		if not self.dirty:
+			return
+
+		rows = [(nid,) + self.scores[nid] for nid in self.dirty]
+		db.executemany('INSERT OR REPLACE INTO node_highscores VALUES(?, ?, ?)', rows)
+		self.dirty.clear()
+
+# Lookup tables for finding nodes by name or ID. The index is updated with the
+# nodes that were added, renamed or deleted in a cycle instead of being rebuilt.
+class NodeIndex:
+	def __init__(self):
+		self.lock = threading.Lock()
+
+		# map of id => name
+		self.names = {}
+		# map of name => tuple of ids (names are almost always unique, and a
+		# tuple of one id is much smaller than a set)
+		self.by_name = {}
+		# map of lower case name => tuple of ids
+		self.by_lower_name = {}
+		# sorted list of (lower case name, id), used for prefix searches
+		self.sorted_names = []
+
+	def _add_name(self, nid, name):
+		self.names[nid] = name
+		if not name:
+			return
+
+		lower = _intern(name.lower())
+		for table, key in [(self.by_name, name), (self.by_lower_name, lower)]:
+			nids = table.get(key, ())
+			if nid not in nids:
+				table[key] = nids + (nid,)
+		bisect.insort(self.sorted_names, (lower, nid))
+
+	def _remove_name(self, nid, name):
+		if not name:
+			return
+
+		lower = name.lower()
+		for table, key in [(self.by_name, name), (self.by_lower_name, lower)]:
+			nids = tuple(other for other in table.get(key, ()) if other != nid)
+			if nids:
+				table[key] = nids
+			else:
+				table.pop(key, None)
+
+		pos = bisect.bisect_left(self.sorted_names, (lower, nid))
+		if pos < len(self.sorted_names) and self.sorted_names[pos] == (lower, nid):
+			del self.sorted_names[pos]
+
+	# added and deleted are lists of nodes, renamed is a list of (old node, new node)
+	def update(self, added, deleted, renamed):
+		with self.lock:
+			for node in added:
+				self._add_name(node.nid, node.name)
+
+			for node in deleted:
+				self._remove_name(node.nid, node.name)
+				del self.names[node.nid]
+
+			for old_node, node in renamed:
+				self._remove_name(old_node.nid, old_node.name)
+				self._add_name(node.nid, node.name)
+
+	# all (lower case name, id) entries starting with the given prefix
+	def _prefix_range(self, prefix, limit):
+		pos = bisect.bisect_left(self.sorted_names, (prefix,))
+		result = []
+		while pos < len(self.sorted_names) and len(result) < limit:
+			entry = self.sorted_names[pos]
+			if not entry[0].startswith(prefix):
+				break
+			result.append(entry)
+			pos += 1
+		return result
+
+	# returns the id of the node matching the identifier, or None. Exact names and IDs
+	# are preferred over case insensitive names and unique name prefixes.
+	def find(self, identifier):
+		with self.lock:
+			nids = self.by_name.get(identifier)
+			if nids:
+				return min(nids)
+
+			if identifier in self.names:
+				return identifier
+
+			lower = identifier.lower()
+			if lower in self.names:
+				return lower
+
+			nids = self.by_lower_name.get(lower)
+			if nids:
+				return min(nids)
+
+			matches = self._prefix_range(lower, 2)
+			if len(matches) == 1:
+				return matches[0][1]
+
+			return None
+
+	# returns up to num names similar to the identifier
+	def suggest(self, identifier, num=5):
+		with self.lock:
+			lower = identifier.lower()
+
+			matches = self._prefix_range(lower, num)
+			if matches:
+				return [self.names[nid] for name, nid in matches]
+
+			# only compare against names sharing the longest possible prefix with the
+			# identifier, a full scan would depend on the size of the network
+			for length in range(len(lower) - 1, 0, -1):
+				matches = self._prefix_range(lower[:length], 50)
+				if matches:
+					break
+
+			candidates = {}
+			for name, nid in matches:
+				candidates.setdefault(name, self.names[nid])
+
+			return [candidates[name] for name in difflib.get_close_matches(lower, candidates.keys(), n=num)]
+
+# Nodes sorted by a count (e.g. connected clients), highest first. Only the
+# counts that changed in a cycle are updated.
+class NodeRanking:
+	def __init__(self):
+		self.lock = threading.Lock()
+
+		# map of id => count
+		self.counts = {}
+		# sorted list of (-count, id)
+		self.ranking = []
+
+	def _remove(self, nid):
+		count = self.counts.pop(nid, None)
+		if count is None:
+			return
+
+		pos = bisect.bisect_left(self.ranking, (-count, nid))
+		if pos < len(self.ranking) and self.ranking[pos] == (-count, nid):
+			del self.ranking[pos]
+
+	# changes is a list of (id, count), count None removes the node
+	def update(self, changes):
+		with self.lock:
+			for nid, count in changes:
+				if self.counts.get(nid) == count:
+					continue
+
+				self._remove(nid)
+				if count is not None:
+					self.counts[nid] = count
+					bisect.insort(self.ranking, (-count, nid))
+
+	# returns the num highest (count, id) pairs whose id is contained in nodes
+	def top(self, num, nodes):
+		result = []
+		with self.lock:
+			for negcount, nid in self.ranking:
+				if len(result) >= num:
+					break
+
+				# the ranking may already be updated for the next snapshot
+				if nid in nodes:
+					result.append( (-negcount, nid) )
+
+		return result
+
+# Appends lines to the log files. Lines are buffered until flush() is called once
+# per cycle, and the files stay open between cycles. If a log file is moved away
+# (e.g. by logrotate), it is reopened under its configured name.
+class LogWriter:
+	def __init__(self):
+		# map of path => open file
+		self.files = {}
+		# map of path => list of lines
+		self.buffers = {}
+		self.lastSync = time.monotonic()
+
+	# path may be None or '' for disabled logs
+	def write(self, path, line):
+		if path:
+			self.buffers.setdefault(path, []).append(line)
+
+	def _open(self, path):
+		logfile = self.files.get(path)
+		if logfile:
+			try:
+				stat = os.stat(path)
+				fstat = os.fstat(logfile.fileno())
+				if (stat.st_dev, stat.st_ino) == (fstat.st_dev, fstat.st_ino):
+					return logfile
+			except FileNotFoundError:
+				pass
+
+			# the file was rotated; everything written so far is in the old file
+			logfile.close()
+
+		logfile = open(path, 'ab')
+		self.files[path] = logfile
+		return logfile
+
+	# returns the number of bytes written
+	def flush(self):
+		now = time.monotonic()
+		sync = config.LOG_FSYNC_INTERVAL is not None and now - self.lastSync >= config.LOG_FSYNC_INTERVAL
+
+		written = 0
+		for path, lines in self.buffers.items():
+			if not lines:
+				continue
+
+			data = "".join(lines).encode('utf-8')
+			logfile = self._open(path)
+			logfile.write(data)
+			logfile.flush()
+			written += len(data)
+
+			if sync:
+				os.fsync(logfile.fileno())
+
+		if sync:
+			self.lastSync = now
+
+		self.buffers = {}
+		return written
+
+	def close(self):
+		self.flush()
+		for logfile in self.files.values():
+			logfile.close()
+		self.files = {}
+
+# The network state at the end of the last cycle, so a restarted bot can
+# continue diffing against it instead of starting over. The file is replaced
+# atomically after every cycle.
+class Checkpoint:
+	VERSION = 1
+
+	def __init__(self, path):
+		self.path = path
+
+	# returns the number of bytes written
+	def save(self, snap):
+		data = {'version': Checkpoint.VERSION,
+		        'timestamp': snap.timestamp,
+		        'aggregates': [snap.num_nodes, snap.num_nodes_online, snap.num_clients],
+		        'nodes': [node.toCheckpoint() for node in snap.nodes.values()]}
+
+		# json.dumps() encodes in C, json.dump() would encode piece by piece in Python
+		encoded = json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+		tmppath = self.path + '.tmp'
+		with open(tmppath, 'wb') as f:
+			f.write(encoded)
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(tmppath, self.path)
+
+		return len(encoded)
+
+	# returns the saved snapshot, or None if there is no usable checkpoint
+	def load(self):
+		if not os.path.exists(self.path):
+			return None
+
+		try:
+			with open(self.path, 'r') as f:
+				data = json.load(f)
+
+			if data['version'] != Checkpoint.VERSION:
+				print("Ignoring checkpoint: unsupported version {}".format(data['version']))
+				return None
+
+			age = time.time() - data['timestamp']
+			if config.CHECKPOINT_MAX_AGE is not None and age > config.CHECKPOINT_MAX_AGE:
+				print("Ignoring checkpoint: {:.0f} s old".format(age))
+				return None
+
+			nodes = {}
+			for record in data['nodes']:
+				node = Node.fromCheckpoint(record)
+				nodes[node.nid] = node
+
+			snap = NetworkSnapshot(nodes, data['timestamp'])
+			if [snap.num_nodes, snap.num_nodes_online, snap.num_clients] != data['aggregates']:
+				print("Ignoring checkpoint: inconsistent node data")
+				return None
+
+			return snap
+		except (OSError, ValueError, KeyError, TypeError) as e:
+			print("Ignoring checkpoint: {}".format(str(e)))
+			return None
+
+# Durations of the phases of a community's update cycles as histograms, and
+# counters of the work done in them. Written by the cycle thread, read by !perf
+# and the metrics endpoint.
+class CycleMetrics:
+	# 'parse' includes the construction of the nodes, both happen in one pass
+	PHASES = ['fetch', 'parse', 'diff', 'highscores', 'events', 'net_highscores',
+	          'logging', 'broadcast', 'checkpoint', 'cycle']
+
+	# upper bounds of the histogram buckets in seconds; the last bucket is +Inf
+	BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+	# (name, description)
+	COUNTERS = [('nodes_parsed', 'Nodes parsed from nodes.json'),
+	            ('events_emitted', 'Events written to the broadcast'),
+	            ('db_statements', 'SQLite statements executed'),
+	            ('log_bytes_written', 'Bytes written to the log files'),
+	            ('broadcast_bytes_written', 'Bytes written to the broadcast'),
+	            ('checkpoint_bytes_written', 'Bytes written to the checkpoint')]
+
+	def __init__(self):
+		self.lock = threading.Lock()
+
+		self.phases = {}
+		for phase in CycleMetrics.PHASES:
+			self.phases[phase] = {'buckets': [0] * (len(CycleMetrics.BUCKETS) + 1),
+			                      'sum': 0.0, 'count': 0, 'last': 0.0, 'max': 0.0}
+
+		self.counters = dict.fromkeys((name for name, description in CycleMetrics.COUNTERS), 0)
+
+	# records the duration of a phase that started at start (time.monotonic()) and
+	# returns the current time, which is the start of the next phase
+	def observe(self, phase, start):
+		now = time.monotonic()
+		duration = now - start
+
+		with self.lock:
+			histogram = self.phases[phase]
+			histogram['buckets'][bisect.bisect_left(CycleMetrics.BUCKETS, duration)] += 1
+			histogram['sum'] += duration
+			histogram['count'] += 1
+			histogram['last'] = duration
+			histogram['max'] = max(histogram['max'], duration)
+
+		return now
+
+	def count(self, name, value=1):
+		with self.lock:
+			self.counters[name] += value
+
+	def stats(self):
+		with self.lock:
+			return {'phases': {phase: dict(histogram, buckets=list(histogram['buckets']))
+			                   for phase, histogram in self.phases.items()},
+			        'counters': dict(self.counters)}
+
+# Settings of one community: its entry of config.COMMUNITIES, falling back to the
+# global configuration for everything the entry does not set
+class CommunitySettings:
+	def __init__(self, overrides):
+		self.overrides = overrides
+
+	def __getattr__(self, name):
+		if name in self.overrides:
+			return self.overrides[name]
+		return getattr(config, name)
+
+# All state of one tracked community: its network, highscores, logs and the
+# target its notifications go to. The update cycles of all communities run
+# concurrently in the bot's thread pool.
+class Community:
+	def __init__(self, settings, name, target, outboundQueue, broadcast=None):
+		self.settings = settings
+		self.name = name
+
+		# the database, logs and binary store of a community are written by one
+		# process at a time, the bot or replay.py
+		self.lock_file = open(settings.DATABASE + '.lock', 'w')
+		try:
+			fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+		except BlockingIOError:
+			print("Error: {} is used by another process, stop it first.".format(settings.DATABASE))
+			sys.exit(1)
+		self.target = target
+		self.outboundQueue = outboundQueue
+
+		# replaced as a whole at the end of every update cycle
+		self.snapshot = NetworkSnapshot({})
 
 		self.channel_topic = ""
 
-		self.ratelimiter = Ratelimiter()
+		self.fetcher = NodesFetcher(settings.JSON_URI)
 
-		self.eventHandler = EventHandler()
+		self.logWriter = LogWriter()
+
+		if settings.TSSTORE_DIR:
+			self.clientStore = tsstore.ClientCountStore(settings.TSSTORE_DIR)
+		else:
+			self.clientStore = None
+
+		self.eventHandler = EventHandler(settings, broadcast)
 		self.eventHandler.setTarget(target)
-		self.eventHandler.setRatelimiter(self.ratelimiter)
+		self.eventHandler.setOutboundQueue(outboundQueue)
 
 		self.nodes_highscore        = Highscore('nodes')
 		self.clients_highscore      = Highscore('clients')
 		self.nodes_online_highscore = Highscore('nodes_online')
 
-		# load the global highscores
-		db = sqlite3.connect(config.DATABASE)
+		self.node_highscores = NodeHighscores()
+
+		self.node_index = NodeIndex()
+
+		self.clients_ranking = NodeRanking()
+		self.max_clients_ranking = NodeRanking()
+
+		# the database stays open for the whole runtime; it is used by the cycle threads
+		self.db = sqlite3.connect(settings.DATABASE, check_same_thread=False)
+		self.db.execute('PRAGMA journal_mode=WAL')
+
+		# load the highscores
+		self.nodes_highscore.load(self.db)
+		self.clients_highscore.load(self.db)
+		self.nodes_online_highscore.load(self.db)
+		self.node_highscores.load(self.db)
+
+		self.metrics = CycleMetrics()
+		self.db.set_trace_callback(self.count_db_statement)
 
-		self.nodes_highscore.load(db)
-		self.clients_highscore.load(db)
-		self.nodes_online_highscore.load(db)
+		if settings.CHECKPOINT_FILE:
+			self.checkpoint = Checkpoint(settings.CHECKPOINT_FILE)
+			self.restore_checkpoint()
+		else:
+			self.checkpoint = None
+
+		# serializes update cycles; never taken by command handlers
+		self.cycle_lock = threading.Lock()
+
+		# the running or last update cycle
+		self.future = None
+
+		# cycles not finished before their deadline, dropped before being applied,
+		# and not started because the previous one was still running
+		self.overruns = 0
+		self.aborted_cycles = 0
+		self.missed_cycles = 0
+
+	# closes the files of the community, so another process may use them
+	def close(self):
+		self.logWriter.close()
+		if self.clientStore:
+			self.clientStore.close()
+		self.db.close()
+		self.lock_file.close()
+
+	# the cycles of several communities run at the same time, so their output is
+	# prefixed with the community name
+	def log_message(self, message):
+		if self.name:
+			print("[{}] {}".format(self.name, message))
+		else:
+			print(message)
+
+	# called by SQLite for every statement executed on the database
+	def count_db_statement(self, statement):
+		self.metrics.count('db_statements')
+
+	def find_node(self, snap, identifier):
+		nid = self.node_index.find(identifier)
+		if nid is None:
+			return None
+
+		# the index may already contain nodes of the next snapshot
+		return snap.nodes.get(nid)
+
+	# continues from the state of the last run, so the first cycle reports only
+	# what changed in between
+	def restore_checkpoint(self):
+		snap = self.checkpoint.load()
+		if snap is None:
+			return
+
+		self.node_index.update(snap.nodes.values(), [], [])
+		self.clients_ranking.update([(nid, node.clients) for nid, node in snap.nodes.items()])
+		self.max_clients_ranking.update([(nid, node.max_clients) for nid, node in snap.nodes.items()])
+		self.snapshot = snap
+
+		self.log_message("Restored {} nodes from the checkpoint ({:.0f} s old)".format(
+			snap.num_nodes, time.time() - snap.timestamp))
+
+	# timestamp is the time of the cycle, used for all its records. The cycle is
+	# aborted if it cannot be applied before deadline (on the monotonic clock).
+	def do_cycle(self, timestamp=None, deadline=None):
+		start = time.monotonic()
+
+		try:
+			body = self.fetcher.fetch()
+		except Exception as e:
+			self.log_message("Request failed: {}".format(str(e)))
+			return
+
+		t = self.metrics.observe('fetch', start)
+
+		if body is None:
+			# nodes.json was not regenerated since the last cycle, so there is nothing
+			# to parse. Nodes missing from it still count towards DELETE_TIMEOUT, which
+			# is a number of update cycles; the unchanged rest is reused as it is.
+			known_nodes = self.snapshot.nodes
+			if not any(n.delete_counter for n in known_nodes.values()):
+				return
+			current_nodes = {nid: n for nid, n in known_nodes.items() if not n.delete_counter}
+		else:
+			if self.past_deadline(deadline):
+				return
+
+			try:
+				# only this thread replaces the snapshot, so it is the one diffed against
+				current_nodes = parse_nodes(body, self.snapshot.nodes)
+			except (ValueError, KeyError) as e:
+				self.log_message("Failed to parse JSON: {}".format(str(e)))
+				# the same body would fail again
+				self.fetcher.commit()
+				return
+
+			self.metrics.observe('parse', t)
+			self.metrics.count('nodes_parsed', len(current_nodes))
+
+		if self.past_deadline(deadline):
+			return
+
+		with self.cycle_lock:
+			self.update_network(current_nodes, timestamp)
+		self.fetcher.commit()
+
+		self.metrics.observe('cycle', start)
+
+	# the data of a late cycle is dropped before it is applied, so it cannot
+	# overlap the next cycle
+	def past_deadline(self, deadline):
+		if deadline is None or time.monotonic() < deadline:
+			return False
+
+		self.aborted_cycles += 1
+		self.log_message("Cycle aborted, the next cycle is due")
+		return True
+
+	def update_network(self, current_nodes, timestamp=None):
+		# the published snapshot is only read here; everything below works on
+		# current_nodes until the new snapshot is swapped in
+		old = self.snapshot
+		t = time.monotonic()
+
+		if timestamp is None:
+			timestamp = time.time()
+		self.eventHandler.setTimestamp(timestamp)
+
+		# check if this is the first run
+		firstRun = not old.nodes
+		known_nodes = old.nodes
+		if firstRun:
+			# first load: all nodes are new, but are not announced
+			msg = "ist initialisiert: {:d} bekannte Knoten".format(len(current_nodes))
+			self.outboundQueue.put('action', self.target, msg, OutboundQueue.PRIORITY_NOTICE)
+
+		changes = ChangeSet(known_nodes, current_nodes, firstRun)
+
+		for nid in changes.gone:
+			# copy the node, the published one must not change
+			n = copy.copy(known_nodes[nid])
+			n.delete_counter += 1
+			self.log_message("{} not seen for {} update cycles".format(n.name, n.delete_counter))
+
+			if n.delete_counter >= self.settings.DELETE_TIMEOUT:
+				# if a node was gone long enough, really drop and report it
+				changes.deleted.append(nid)
+			else:
+				# if not, put it back as "still here"
+				current_nodes[nid] = n
+
+		self.node_index.update(
+			[current_nodes[nid] for nid in changes.new],
+			[known_nodes[nid] for nid in changes.deleted],
+			[(known_nodes[nid], current_nodes[nid]) for nid in changes.renamed])
 
-		db.close()
+		t = self.metrics.observe('diff', t)
+
+		# Check new highscores
+		db = self.db
+
+		# per-node client highscore; only nodes that changed can reach a new one
+		new_node_highscores = []
+		max_clients_changes = []
+		for node in changes.updated:
+			if node.updateHighscore(self.node_highscores, timestamp):
+				max_clients_changes.append( (node.nid, node.max_clients) )
+				if not firstRun and node.max_clients > 0:
+					new_node_highscores.append(node)
+
+		self.node_highscores.save(db)
+
+		# new nodes may enter the ranking with a highscore from the database
+		max_clients_changes.extend( (nid, current_nodes[nid].max_clients) for nid in changes.new )
+		max_clients_changes.extend( (nid, None) for nid in changes.deleted )
+
+		clients_changes = [(nid, current_nodes[nid].clients) for nid in changes.new + changes.clients]
+		clients_changes.extend( (nid, None) for nid in changes.deleted )
+
+		self.clients_ranking.update(clients_changes)
+		self.max_clients_ranking.update(max_clients_changes)
+
+		t = self.metrics.observe('highscores', t)
+
+		# build and publish the new network state
+		snap = NetworkSnapshot(current_nodes, self.eventHandler.timestamp)
+		self.snapshot = snap
+
+		if not firstRun:
+			for nid in changes.new:
+				self.eventHandler.newNode(current_nodes[nid])
+
+		for nid in changes.deleted:
+			self.eventHandler.nodeDeleted(known_nodes[nid])
+
+		for nid in changes.status:
+			self.eventHandler.nodeStatusChanged(current_nodes[nid])
+
+		for nid in changes.renamed:
+			self.eventHandler.nodeRenamed(current_nodes[nid], known_nodes[nid])
+
+		for node in new_node_highscores:
+			self.eventHandler.highscoreClientsAtNode(node)
+
+		self.eventHandler.flushNotices()
+
+		t = self.metrics.observe('events', t)
+
+		# nodes registered
+		if self.nodes_highscore.update(snap.num_nodes, timestamp):
+			self.nodes_highscore.save(db)
+			self.eventHandler.highscoreRegisteredNodes(snap.num_nodes)
+
+		# nodes online
+		if self.nodes_online_highscore.update(snap.num_nodes_online, timestamp):
+			self.nodes_online_highscore.save(db)
+			self.eventHandler.highscoreOnlineNodes(snap.num_nodes_online)
+
+		# clients
+		if self.clients_highscore.update(snap.num_clients, timestamp):
+			self.clients_highscore.save(db)
+			self.eventHandler.highscoreOnlineClients(snap.num_clients)
+
+		db.commit()
+
+		self.metrics.observe('net_highscores', t)
+
+		# write a log of changes in the network
+		self.log_network_changes(old, snap, known_nodes, changes)
+
+		# everything above is on disk, so the checkpoint never runs ahead of the logs
+		if self.checkpoint:
+			t = time.monotonic()
+			self.metrics.count('checkpoint_bytes_written', self.checkpoint.save(snap))
+			self.metrics.observe('checkpoint', t)
+
+	def log_network_changes(self, old, snap, known_nodes, changes):
+		current_nodes = snap.nodes
+		timestamp = int(snap.timestamp)
+		log = self.logWriter
+		t = time.monotonic()
+
+		if snap.num_nodes != old.num_nodes:
+			self.eventHandler.registeredNodesChanged(snap.num_nodes)
+			self.log_message("Number of nodes changed: {} -> {}".format(old.num_nodes, snap.num_nodes))
+			log.write(self.settings.LOG_NODECOUNT, "{} {}\n".format(timestamp, snap.num_nodes))
+
+		if snap.num_nodes_online != old.num_nodes_online:
+			self.eventHandler.onlineNodesChanged(snap.num_nodes_online)
+			self.log_message("Number of online nodes changed: {} -> {}".format(old.num_nodes_online, snap.num_nodes_online))
+			log.write(self.settings.LOG_ONLINENODECOUNT, "{} {}\n".format(timestamp, snap.num_nodes_online))
+
+		if snap.num_clients != old.num_clients:
+			self.eventHandler.clientsChanged(snap.num_clients)
+			self.log_message("Number of connected clients changed: {} -> {}".format(old.num_clients, snap.num_clients))
+			log.write(self.settings.LOG_TOTALCLIENTCOUNT, "{} {}\n".format(timestamp, snap.num_clients))
+
+		# the first run only records the initial state, there is nothing to compare
+		new_nodes = [] if changes.initial else changes.new
+
+		# (node, client count) of all nodes with a new client count
+		client_counts = [(current_nodes[nid], current_nodes[nid].clients) for nid in new_nodes + changes.clients]
+		client_counts.extend( (known_nodes[nid], 0) for nid in changes.deleted )
+
+		for node, clientcount in client_counts:
+			self.eventHandler.clientsAtNodeChanged(node)
+			log.write(self.settings.LOG_NODECLIENTCOUNT, "{} {} {}\n".format(timestamp, node.nid, clientcount))
+			if self.clientStore:
+				self.clientStore.add(timestamp, node.nid, clientcount)
+
+		if client_counts:
+			self.log_message("Number of clients changed for {} nodes".format(len(client_counts)))
+
+		if self.settings.LOG_NODENAMES:
+			if not os.path.exists(self.settings.LOG_NODENAMES):
+				# create the file with all current nodes
+				nids = current_nodes.keys()
+			else:
+				nids = new_nodes + changes.renamed
 
+			for nid in nids:
+				node = current_nodes[nid]
+				log.write(self.settings.LOG_NODENAMES, "{} {}\n".format(node.nid, node.name))
+
+		# all lines and events of this cycle are written at once
+		self.metrics.count('log_bytes_written', log.flush())
+		if self.clientStore:
+			self.clientStore.flush()
+
+		t = self.metrics.observe('logging', t)
+
+		events, written = self.eventHandler.flushBroadcasts(snap)
+		self.metrics.count('events_emitted', events)
+		self.metrics.count('broadcast_bytes_written', written)
+
+		self.metrics.observe('broadcast', t)
+
+# Fires the update cycles at fixed epochs of the monotonic clock, so the time
+# spent in a cycle does not add up to a drift of the interval. Epochs missed
+# while a cycle ran late are skipped instead of being run back to back.
+class CycleScheduler:
+	def __init__(self, interval):
+		self.interval = interval
+		self.nextEpoch = None
+
+		# metrics
+		self.cycles = 0
+		self.skippedEpochs = 0
+		self.lastLag = 0.0
+		self.maxLag = 0.0
+		self.totalLag = 0.0
+
+	# waits for the next epoch and returns it together with the wall clock time
+	# of the epoch, which is the timestamp of all records of the cycle
+	def wait(self):
+		now = time.monotonic()
+		if self.nextEpoch is None:
+			self.nextEpoch = now
+
+		if now < self.nextEpoch:
+			time.sleep(self.nextEpoch - now)
+		else:
+			missed = int((now - self.nextEpoch) // self.interval)
+			self.nextEpoch += missed * self.interval
+			self.skippedEpochs += missed
+
+		epoch = self.nextEpoch
+		self.nextEpoch += self.interval
+
+		lag = max(0.0, time.monotonic() - epoch)
+		self.cycles += 1
+		self.lastLag = lag
+		self.maxLag = max(self.maxLag, lag)
+		self.totalLag += lag
+
+		return epoch, time.time() - lag
+
+	def stats(self):
+		return {'cycles': self.cycles,
+		        'skipped': self.skippedEpochs,
+		        'lag': self.lastLag,
+		        'avg_lag': self.totalLag / self.cycles if self.cycles else 0.0,
+		        'max_lag': self.maxLag}
+
+# paths that must differ between communities (the broadcast FIFO or port is
+# checked in main(), depending on BROADCAST_SERVER)
+COMMUNITY_PATHS = ['DATABASE', 'CHECKPOINT_FILE', 'TSSTORE_DIR',
+                   'LOG_NODECOUNT', 'LOG_ONLINENODECOUNT', 'LOG_TOTALCLIENTCOUNT',
+                   'LOG_NODECLIENTCOUNT', 'LOG_NODENAMES']
+
+class FreifunkBot(irc.client.SimpleIRCClient):
+	def __init__(self, target):
+		irc.client.SimpleIRCClient.__init__(self)
+
+		self.outboundQueue = OutboundQueue()
+		self.outboundQueue.setConnection(self.connection)
+		self.reactor.scheduler.execute_every(config.RATELIMIT_INTERVAL, self.outboundQueue.drain)
+
+		# without COMMUNITIES, the bot tracks the community of the global configuration
+		self.communities = []
+		for overrides in config.COMMUNITIES or [{}]:
+			self.communities.append(Community(CommunitySettings(overrides),
+			                                  overrides.get('NAME'),
+			                                  overrides.get('TARGET', target),
+			                                  self.outboundQueue))
+
+		self.pool = concurrent.futures.ThreadPoolExecutor(len(self.communities), thread_name_prefix='cycle')
+
+		self.cycleScheduler = CycleScheduler(config.UPDATE_INTERVAL)
 		self.timer = threading.Thread(target=self.scheduler, daemon=True);
 
-		self.known_nodes_lock = threading.Lock()
+		if config.METRICS_PORT is not None:
+			self.metricsServer = MetricsServer(config.METRICS_HOST, config.METRICS_PORT, self.metrics_text)
+			self.metricsServer.start()
+		else:
+			self.metricsServer = None
 
 	def on_welcome(self, connection, event):
 		# send authentication message
 		if config.AUTH_MESSAGE:
 			connection.privmsg(config.AUTH_TARGET, config.AUTH_MESSAGE)
 
-		if irc.client.is_channel(self.target):
-			connection.join(self.target)
-		elif not self.timer.is_alive():
+		channels = set(c.target for c in self.communities if irc.client.is_channel(c.target))
+		for channel in channels:
+			connection.join(channel)
+
+		if not channels and not self.timer.is_alive():
 			self.timer.start()
 
 	def on_join(self, connection, event):
@@ -287,11 +1724,13 @@ class FreifunkBot(irc.client.SimpleIRCClient):
 
 	def on_currenttopic(self, connection, event):
 		print("CURRENTTOPIC {}: {}".format(event.source, event.arguments))
-		self.channel_topic = event.arguments[1]
+		for community in self.communities_in(event.arguments[0]):
+			community.channel_topic = event.arguments[1]
 
 	def on_topic(self, connection, event):
 		print("TOPIC {}: {}".format(event.source, event.arguments[0]))
-		self.channel_topic = event.arguments[0]
+		for community in self.communities_in(event.target):
+			community.channel_topic = event.arguments[0]
 
 	def on_privmsg(self, connection, event):
 		source = event.source.split('!',1)[0]
@@ -301,22 +1740,139 @@ class FreifunkBot(irc.client.SimpleIRCClient):
 		self.handle_message(msg, source, False)
 
 	def on_pubmsg(self, connection, event):
-		source = self.target
+		source = event.target
 		msg = event.arguments[0]
 		print("PUBMSG {}: {}".format(source, msg))
 
 		self.handle_message(msg, source, True)
 
+	def communities_in(self, channel):
+		return [c for c in self.communities if irc.client.is_channel(c.target) and c.target.lower() == channel.lower()]
+
+	# returns the community a command refers to: the one given by name, else the
+	# first one whose channel the command was sent to, else the first one
+	def find_community(self, name, response_target, is_public):
+		if name:
+			for community in self.communities:
+				if community.name == name:
+					return community
+			return None
+
+		if is_public:
+			communities = self.communities_in(response_target)
+			if communities:
+				return communities[0]
+
+		return self.communities[0]
+
+	# the metrics of all communities and the scheduler in the Prometheus text format
+	def metrics_text(self):
+		stats = [(community, community.metrics.stats()) for community in self.communities]
+
+		def label(community):
+			name = (community.name or '').replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+			return 'community="{}"'.format(name)
+
+		lines = ['# HELP freifunk_bot_phase_seconds Duration of the phases of the update cycles',
+		         '# TYPE freifunk_bot_phase_seconds histogram']
+		for community, cstats in stats:
+			for phase in CycleMetrics.PHASES:
+				histogram = cstats['phases'][phase]
+				labels = '{},phase="{}"'.format(label(community), phase)
+
+				cumulative = 0
+				for bound, count in zip(CycleMetrics.BUCKETS + ['+Inf'], histogram['buckets']):
+					cumulative += count
+					lines.append('freifunk_bot_phase_seconds_bucket{{{},le="{}"}} {}'.format(labels, bound, cumulative))
+				lines.append('freifunk_bot_phase_seconds_sum{{{}}} {}'.format(labels, histogram['sum']))
+				lines.append('freifunk_bot_phase_seconds_count{{{}}} {}'.format(labels, histogram['count']))
+
+		counters = CycleMetrics.COUNTERS + [
+			('cycle_overruns', 'Update cycles not finished before their deadline'),
+			('cycles_aborted', 'Update cycles dropped before their data was applied'),
+			('cycles_missed', 'Update cycles not started because the previous one was still running')]
+		for name, description in counters:
+			lines.append('# HELP freifunk_bot_{}_total {}'.format(name, description))
+			lines.append('# TYPE freifunk_bot_{}_total counter'.format(name))
+			for community, cstats in stats:
+				if name == 'cycle_overruns':
+					value = community.overruns
+				elif name == 'cycles_aborted':
+					value = community.aborted_cycles
+				elif name == 'cycles_missed':
+					value = community.missed_cycles
+				else:
+					value = cstats['counters'][name]
+				lines.append('freifunk_bot_{}_total{{{}}} {}'.format(name, label(community), value))
+
+		# (source, name, type, description, stats key) of the fetcher and the broadcast sink of
+		# every community; a broadcast metric is only exported where its sink has it
+		families = [
+			('fetch', 'fetch_bytes', 'gauge', 'Size of the last fetched nodes.json', 'bytes'),
+			('fetch', 'fetch_latency_seconds', 'gauge', 'Duration of the last fetch of nodes.json', 'latency'),
+			('fetch', 'fetch_bytes_total', 'counter', 'Bytes of nodes.json fetched', 'total_bytes'),
+			('fetch', 'fetch_skipped_cycles_total', 'counter', 'Update cycles skipped because nodes.json was unchanged', 'skipped_cycles'),
+			('broadcast', 'broadcast_backlog_bytes', 'gauge', 'Bytes waiting for the reader of the broadcast FIFO', 'backlog_bytes'),
+			('broadcast', 'broadcast_dropped_events_total', 'counter', 'Broadcast events dropped because the FIFO backlog was full', 'dropped_events'),
+			('broadcast', 'broadcast_clients', 'gauge', 'Connected broadcast subscribers', 'clients'),
+			('broadcast', 'broadcast_connected_clients_total', 'counter', 'Broadcast subscribers that connected', 'connected_clients'),
+			('broadcast', 'broadcast_disconnected_slow_clients_total', 'counter', 'Broadcast subscribers disconnected for reading too slowly', 'disconnected_slow_clients')]
+		sources = [(community, {'fetch': community.fetcher.stats(), 'broadcast': community.eventHandler.broadcast.stats()})
+		           for community in self.communities]
+		for source, name, kind, description, key in families:
+			samples = [(community, cstats[source][key]) for community, cstats in sources if key in cstats[source]]
+			if not samples:
+				continue
+
+			lines.append('# HELP freifunk_bot_{} {}'.format(name, description))
+			lines.append('# TYPE freifunk_bot_{} {}'.format(name, kind))
+			for community, value in samples:
+				lines.append('freifunk_bot_{}{{{}}} {}'.format(name, label(community), value))
+
+		queue = self.outboundQueue.metrics()
+		lines.extend([
+			'# HELP freifunk_bot_outbound_queue_depth Messages waiting in the outbound queue',
+			'# TYPE freifunk_bot_outbound_queue_depth gauge',
+			'freifunk_bot_outbound_queue_depth {}'.format(queue['depth']),
+			'# HELP freifunk_bot_outbound_messages_sent_total Messages sent from the outbound queue',
+			'# TYPE freifunk_bot_outbound_messages_sent_total counter',
+			'freifunk_bot_outbound_messages_sent_total {}'.format(queue['sent']),
+			'# HELP freifunk_bot_outbound_messages_dropped_total Messages dropped because the outbound queue was full',
+			'# TYPE freifunk_bot_outbound_messages_dropped_total counter',
+			'freifunk_bot_outbound_messages_dropped_total {}'.format(queue['dropped']),
+			'# HELP freifunk_bot_outbound_wait_seconds_avg Average time the sent messages waited in the outbound queue',
+			'# TYPE freifunk_bot_outbound_wait_seconds_avg gauge',
+			'freifunk_bot_outbound_wait_seconds_avg {}'.format(queue['avg_wait']),
+			'# HELP freifunk_bot_outbound_wait_seconds_max Longest time a sent message waited in the outbound queue',
+			'# TYPE freifunk_bot_outbound_wait_seconds_max gauge',
+			'freifunk_bot_outbound_wait_seconds_max {}'.format(queue['max_wait'])])
+
+		scheduler = self.cycleScheduler.stats()
+		lines.extend([
+			'# HELP freifunk_bot_scheduler_lag_seconds Delay of the last cycle start after its epoch',
+			'# TYPE freifunk_bot_scheduler_lag_seconds gauge',
+			'freifunk_bot_scheduler_lag_seconds {}'.format(scheduler['lag']),
+			'# HELP freifunk_bot_scheduler_skipped_epochs_total Epochs skipped because a cycle ran late',
+			'# TYPE freifunk_bot_scheduler_skipped_epochs_total counter',
+			'freifunk_bot_scheduler_skipped_epochs_total {}'.format(scheduler['skipped'])])
+
+		return "\n".join(lines) + "\n"
+
 	def send_command_response(self, message, target):
-		self.ratelimiter.ratelimit()
-		self.connection.privmsg(target, message)
+		if irc.client.is_channel(target):
+			priority = OutboundQueue.PRIORITY_PUBLIC
+		else:
+			priority = OutboundQueue.PRIORITY_PRIVATE
+
+		self.outboundQueue.put('privmsg', target, message, priority)
 
-	def find_node(self, identifier):
-		for node in self.known_nodes.values():
-			if node.name == identifier or node.nid == identifier:
-				return node
+	def send_node_not_found(self, community, identifier, target):
+		suggestions = community.node_index.suggest(identifier)
+		if suggestions:
+			self.send_command_response("Es gibt keinen Knoten mit diesem Namen. Meintest du: {}?".format(
+				", ".join(suggestions)), target)
 		else:
-			return None
+			self.send_command_response("Es gibt keinen Knoten mit diesem Namen.", target)
 
 	def handle_message(self, message, response_target, is_public):
 		# check if this is a command for me
@@ -329,59 +1885,65 @@ class FreifunkBot(irc.client.SimpleIRCClient):
 		if len(cmdparts) < 1:
 			return
 
-		command = cmdparts[0]
+		# commands may name the community they refer to: !status@name
+		command, _, community_name = cmdparts[0].partition('@')
+
+		community = self.find_community(community_name, response_target, is_public)
+		if community is None:
+			self.send_command_response("Unbekannte Community. Bekannt sind: {}".format(
+				", ".join(c.name for c in self.communities if c.name)), response_target)
+			return
+
+		# all replies of a command are based on the same network state
+		snap = community.snapshot
 
 		if command == "status":
 			if len(cmdparts) == 1:
-				with self.known_nodes_lock:
-					self.send_command_response(
-							"Status des gesamten Netzwerks: {} von {} Knoten online mit {} Clients.".format(
-								self.num_nodes_online,
-								self.num_nodes,
-								self.num_clients),
-							response_target)
+				self.send_command_response(
+						"Status des gesamten Netzwerks: {} von {} Knoten online mit {} Clients.".format(
+							snap.num_nodes_online,
+							snap.num_nodes,
+							snap.num_clients),
+						response_target)
 			else:
-				with self.known_nodes_lock:
-					node = self.find_node(cmdparts[1])
-					if node:
-						if node.online:
-							self.send_command_response(
-									"Knoten {} ist online und hat {} Clients.".format(
-										node.fullIdentifier(), node.clients),
-									response_target)
-						else:
-							self.send_command_response("Knoten {} ist offline.".format(node.fullIdentifier()), response_target)
+				node = community.find_node(snap, cmdparts[1])
+				if node:
+					if node.online:
+						self.send_command_response(
+								"Knoten {} ist online und hat {} Clients.".format(
+									node.fullIdentifier(), node.clients),
+								response_target)
 					else:
-						self.send_command_response("Es gibt keinen Knoten mit diesem Namen.", response_target)
+						self.send_command_response("Knoten {} ist offline.".format(node.fullIdentifier()), response_target)
+				else:
+					self.send_node_not_found(community, cmdparts[1], response_target)
 		elif command == "highscore":
 			if len(cmdparts) == 1:
-				with self.known_nodes_lock:
-					self.send_command_response(
-							"Knoten im Netzwerk: {:4d}, erreicht: {}".format(
-								self.nodes_highscore.value,
-								time.strftime(config.TIME_FORMAT, time.localtime(self.nodes_highscore.timestamp))),
-							response_target)
-					self.send_command_response(
-							"Knoten online:      {:4d}, erreicht: {}".format(
-								self.nodes_online_highscore.value,
-								time.strftime(config.TIME_FORMAT, time.localtime(self.nodes_online_highscore.timestamp))),
-							response_target)
+				self.send_command_response(
+						"Knoten im Netzwerk: {:4d}, erreicht: {}".format(
+							community.nodes_highscore.value,
+							time.strftime(config.TIME_FORMAT, time.localtime(community.nodes_highscore.timestamp))),
+						response_target)
+				self.send_command_response(
+						"Knoten online:      {:4d}, erreicht: {}".format(
+							community.nodes_online_highscore.value,
+							time.strftime(config.TIME_FORMAT, time.localtime(community.nodes_online_highscore.timestamp))),
+						response_target)
+				self.send_command_response(
+						"Clients verbunden:  {:4d}, erreicht: {}".format(
+							community.clients_highscore.value,
+							time.strftime(config.TIME_FORMAT, time.localtime(community.clients_highscore.timestamp))),
+						response_target)
+			else:
+				node = community.find_node(snap, cmdparts[1])
+				if node:
 					self.send_command_response(
-							"Clients verbunden:  {:4d}, erreicht: {}".format(
-								self.clients_highscore.value,
-								time.strftime(config.TIME_FORMAT, time.localtime(self.clients_highscore.timestamp))),
+							"Knoten {} hatte bisher max. {} Clients (erreicht: {}).".format(
+								node.fullIdentifier(), node.max_clients,
+								time.strftime(config.TIME_FORMAT, time.localtime(node.max_clients_timestamp))),
 							response_target)
-			else:
-				with self.known_nodes_lock:
-					node = self.find_node(cmdparts[1])
-					if node:
-						self.send_command_response(
-								"Knoten {} hatte bisher max. {} Clients (erreicht: {}).".format(
-									node.fullIdentifier(), node.max_clients,
-									time.strftime(config.TIME_FORMAT, time.localtime(node.max_clients_timestamp))),
-								response_target)
-					else:
-						self.send_command_response("Es gibt keinen Knoten mit diesem Namen.", response_target)
+				else:
+					self.send_node_not_found(community, cmdparts[1], response_target)
 		elif command == "nodes":
 			if is_public:
 				self.send_command_response("Dieser Befehl ist nur als private Nachricht erlaubt.", response_target)
@@ -394,36 +1956,35 @@ class FreifunkBot(irc.client.SimpleIRCClient):
 				except ValueError:
 					pass # use default
 
-			with self.known_nodes_lock:
-				max_name_len = 0
-				for node in self.known_nodes.values():
-					if len(node.name) > max_name_len:
-						max_name_len = len(node.name)
+			max_name_len = 0
+			for node in snap.nodes.values():
+				if len(node.name) > max_name_len:
+					max_name_len = len(node.name)
 
-				i = 0
-				msg = ""
-				for node in self.known_nodes.values():
-					msg += "[{0}] {1:{width}} ".format(node.nid, node.name, width=max_name_len)
-					if i % cols == (cols - 1):
-						self.send_command_response(msg.rstrip(), response_target)
-						msg = ""
+			i = 0
+			msg = ""
+			for node in snap.nodes.values():
+				msg += "[{0}] {1:{width}} ".format(node.nid, node.name, width=max_name_len)
+				if i % cols == (cols - 1):
+					self.send_command_response(msg.rstrip(), response_target)
+					msg = ""
 
-					i += 1
+				i += 1
 
-				if msg != "":
-					self.send_command_response(msg, response_target)
+			if msg != "":
+				self.send_command_response(msg, response_target)
 
 		elif command == "topic":
-			pos = self.channel_topic.rfind('|')
+			pos = community.channel_topic.rfind('|')
 			new_topic = "{}| {} von {} Knoten online".format(
-					self.channel_topic[0:pos],
-					self.num_nodes_online,
-					self.num_nodes)
+					community.channel_topic[0:pos],
+					snap.num_nodes_online,
+					snap.num_nodes)
 
 			if config.TOPIC_USE_CHANSERV:
-				self.connection.privmsg("chanserv", "topic {} {}".format(self.target, new_topic))
+				self.connection.privmsg("chanserv", "topic {} {}".format(community.target, new_topic))
 			else:
-				self.connection.topic(self.target, new_topic)
+				self.connection.topic(community.target, new_topic)
 		elif command == "top":
 			num = 3
 			if len(cmdparts) >= 2:
@@ -432,48 +1993,99 @@ class FreifunkBot(irc.client.SimpleIRCClient):
 				except ValueError:
 					pass # use default
 
-			num = min(num, len(self.known_nodes))
+			num = min(num, len(snap.nodes))
 
 			nodes_limited = False
 			if is_public and num > config.PUBLIC_MAX_NODES:
 				nodes_limited = True
 				num = config.PUBLIC_MAX_NODES
 
-			with self.known_nodes_lock:
-				nodes_cur_clients = []
-				nodes_max_clients = []
-				max_name_len = 0
+			nodes_cur_clients = community.clients_ranking.top(num, snap.nodes)
+			nodes_max_clients = community.max_clients_ranking.top(num, snap.nodes)
+			num = min(num, len(nodes_cur_clients), len(nodes_max_clients))
 
-				for node in self.known_nodes.values():
-					nodes_cur_clients.append( (node.clients, node.nid) )
-					nodes_max_clients.append( (node.max_clients, node.nid) )
+			# the column width only depends on the listed nodes
+			max_name_len = 0
+			for i in range(num):
+				for count, nid in [nodes_cur_clients[i], nodes_max_clients[i]]:
+					max_name_len = max(max_name_len, len(snap.nodes[nid].name))
 
-					if len(node.name) > max_name_len:
-						max_name_len = len(node.name)
+			# -- Clients aktuell -----------------|-- Client-Highscore ----------------
+			# [00:00:00:00:00:00] Knoten-Name     |[00:00:00:00:00:00] Knoten-Name
 
-				nodes_cur_clients.sort(reverse=True)
-				nodes_max_clients.sort(reverse=True)
+			col_width = 25 + max_name_len + 1
+			msg = '-- Clients aktuell ' + '-'*(col_width-19) + '|-- Client-Highscore ' + '-'*(col_width-20)
+			self.send_command_response(msg, response_target)
 
-				# -- Clients aktuell -----------------|-- Client-Highscore ----------------
-				# [00:00:00:00:00:00] Knoten-Name     |[00:00:00:00:00:00] Knoten-Name
+			for i in range(num):
+				lnode = snap.nodes[ nodes_cur_clients[i][1] ]
+				rnode = snap.nodes[ nodes_max_clients[i][1] ]
 
-				col_width = 25 + max_name_len + 1
-				msg = '-- Clients aktuell ' + '-'*(col_width-19) + '|-- Client-Highscore ' + '-'*(col_width-20)
+				msg = "{0:4d} [{1}] {2:{width}} |{3:4d} [{4}] {5:{width}} ".format(
+						lnode.clients, lnode.nid, lnode.name,
+						rnode.max_clients, rnode.nid, rnode.name,
+						width=max_name_len)
 				self.send_command_response(msg, response_target)
 
-				for i in range(num):
-					lnode = self.known_nodes[ nodes_cur_clients[i][1] ]
-					rnode = self.known_nodes[ nodes_max_clients[i][1] ]
+			if nodes_limited:
+				msg = 'Im Channel werden maximal {} Knoten aufgelistet. Benutze eine private Nachricht, um mehr Knoten aufzulisten.'.format(config.PUBLIC_MAX_NODES)
+				self.send_command_response(msg, response_target)
 
-					msg = "{0:4d} [{1}] {2:{width}} |{3:4d} [{4}] {5:{width}} ".format(
-							lnode.clients, lnode.nid, lnode.name,
-							rnode.max_clients, rnode.nid, rnode.name,
-							width=max_name_len)
-					self.send_command_response(msg, response_target)
+		elif command == "perf":
+			if is_public:
+				self.send_command_response("Dieser Befehl ist nur als private Nachricht erlaubt.", response_target)
+				return
 
-				if nodes_limited:
-					msg = 'Im Channel werden maximal {} Knoten aufgelistet. Benutze eine private Nachricht, um mehr Knoten aufzulisten.'.format(config.PUBLIC_MAX_NODES)
-					self.send_command_response(msg, response_target)
+			stats = community.metrics.stats()
+			for phase in CycleMetrics.PHASES:
+				histogram = stats['phases'][phase]
+				if histogram['count'] == 0:
+					continue
+
+				self.send_command_response(
+						"{:15} zuletzt {:8.3f} s, Mittel {:8.3f} s, max. {:8.3f} s ({} Zyklen)".format(
+							phase, histogram['last'], histogram['sum'] / histogram['count'], histogram['max'],
+							histogram['count']),
+						response_target)
+
+			counters = stats['counters']
+			self.send_command_response(
+					"Knoten gelesen: {}, Events: {}, DB-Statements: {}, geschrieben: {} Bytes Logs, {} Bytes Broadcast, {} Bytes Checkpoint".format(
+						counters['nodes_parsed'], counters['events_emitted'], counters['db_statements'],
+						counters['log_bytes_written'], counters['broadcast_bytes_written'],
+						counters['checkpoint_bytes_written']),
+					response_target)
+
+			scheduler = self.cycleScheduler.stats()
+			self.send_command_response(
+					"Zyklen: {} zu spät, {} abgebrochen, {} ausgelassen; Verzögerung zuletzt {:.3f} s, max. {:.3f} s".format(
+						community.overruns, community.aborted_cycles, community.missed_cycles,
+						scheduler['lag'], scheduler['max_lag']),
+					response_target)
+
+			fetch = community.fetcher.stats()
+			self.send_command_response(
+					"Abruf: zuletzt {} Bytes in {:.3f} s, insgesamt {} Bytes, {} Zyklen ohne Änderung".format(
+						fetch['bytes'], fetch['latency'], fetch['total_bytes'], fetch['skipped_cycles']),
+					response_target)
+
+			broadcast = community.eventHandler.broadcast.stats()
+			if 'dropped_events' in broadcast:
+				self.send_command_response(
+						"Broadcast: {} Bytes ausstehend, {} Events verworfen".format(
+							broadcast['backlog_bytes'], broadcast['dropped_events']),
+						response_target)
+			else:
+				self.send_command_response(
+						"Broadcast: {} Clients verbunden, {} insgesamt, {} zu langsame getrennt".format(
+							broadcast['clients'], broadcast['connected_clients'], broadcast['disconnected_slow_clients']),
+						response_target)
+
+			queue = self.outboundQueue.metrics()
+			self.send_command_response(
+					"Ausgabe: {} Nachrichten wartend, {} gesendet, {} verworfen; Wartezeit im Mittel {:.2f} s, max. {:.2f} s".format(
+						queue['depth'], queue['sent'], queue['dropped'], queue['avg_wait'], queue['max_wait']),
+					response_target)
 
 		elif command == "help":
 			self.send_command_response("status [<node>]     Status des Netzwerks oder eines Knotens anzeigen", response_target)
@@ -481,194 +2093,54 @@ class FreifunkBot(irc.client.SimpleIRCClient):
 			self.send_command_response("nodes [<cols>]      Alle Knoten im Netz auflisten (ID und Name), in <cols> Spalten", response_target)
 			self.send_command_response("top [<num>]         Die <num> meistgenutzen Knoten auflisten (aktuell und Highscore)", response_target)
 			self.send_command_response("topic               Topic mit aktuellen Knotenzahlen aktualisieren (Text nach letztem | wird ersetzt)", response_target)
-			self.send_command_response("<node> kann ein Knoten-Name oder eine ID (MAC-Adresse) sein.", response_target)
+			self.send_command_response("perf                Laufzeiten der Update-Zyklen anzeigen (nur als private Nachricht)", response_target)
+			self.send_command_response("<node> kann ein Knoten-Name, ein eindeutiger Namensanfang oder eine ID (MAC-Adresse) sein.", response_target)
+			if len(self.communities) > 1:
+				self.send_command_response("!<befehl>@<community> führt einen Befehl für eine andere Community aus ({}).".format(
+					", ".join(c.name for c in self.communities if c.name)), response_target)
 		else:
 			self.send_command_response("Unbekannter Befehl. Benutze !help, um Befehle aufzulisten.", response_target)
 
 	def scheduler(self):
 		while True:
-			self.do_freifunk_cycle()
-			time.sleep(config.UPDATE_INTERVAL)
-
-	def do_freifunk_cycle(self):
-		try:
-			r = requests.get(config.JSON_URI, timeout=config.REQUEST_TIMEOUT)
-		except Exception as e:
-			print("Request failed: {}".format(str(e)))
-			return
-
-		with self.known_nodes_lock:
+			epoch, timestamp = self.cycleScheduler.wait()
+			self.do_freifunk_cycle(timestamp, epoch + config.UPDATE_INTERVAL)
+
+	# runs one update cycle of every community in the thread pool and waits for
+	# each one until its deadline: CYCLE_DEADLINE, but never later than the next
+	# epoch. A cycle running past its deadline is not waited for, so a slow map
+	# server only delays its own community, which skips its cycles until the late
+	# one has finished. A cycle still running at the next epoch drops its data
+	# instead of applying it during the next cycle.
+	def do_freifunk_cycle(self, timestamp=None, nextEpoch=None):
+		start = time.monotonic()
+		if timestamp is None:
+			timestamp = time.time()
+
+		started = []
+		for community in self.communities:
+			if community.future and not community.future.done():
+				community.missed_cycles += 1
+				community.log_message("Previous cycle still running, skipping this cycle")
+				continue
+
+			deadline = start + community.settings.CYCLE_DEADLINE
+			if nextEpoch is not None:
+				deadline = min(deadline, nextEpoch)
+
+			community.future = self.pool.submit(community.do_cycle, timestamp, nextEpoch)
+			started.append((community, deadline))
+
+		for community, deadline in started:
 			try:
-				json = r.json()
-			except ValueError as e:
-				print("Failed to parse JSON:".format(str(e)))
-				return
-
-			current_nodes = {}
-			for node in json['nodes'].values():
-				try:
-					n = Node(node)
-					current_nodes[n.nid] = n
-				except KeyError as e:
-					# node is missing relevant information for tracking
-					pass
-
-			# Update connection reference of the event handler before sending messages
-			self.eventHandler.setConnection(self.connection)
-			self.eventHandler.setTimestamp(time.time())
-
-			# check if this is the first run
-			firstRun = not self.known_nodes
-			if firstRun:
-				# first load
-				self.known_nodes = current_nodes
-				msg = "ist initialisiert: {:d} bekannte Knoten".format(len(current_nodes))
-				self.connection.action(self.target, msg)
-
-			current_nids = set(current_nodes.keys())
-			known_nids = set(self.known_nodes.keys())
-
-			new_nodes  = list(current_nids - known_nids)
-			gone_nodes = list(known_nids - current_nids)
-
-			really_gone_nodes = []
-			for nid in gone_nodes:
-				n = self.known_nodes[nid]
-				n.delete_counter += 1
-				print("{} not seen for {} update cycles".format(n.name, n.delete_counter))
-
-				if n.delete_counter >= config.DELETE_TIMEOUT:
-					# if a node was gone long enough, really drop and report it
-					really_gone_nodes.append(nid)
-				else:
-					# if not, put it back as "still here"
-					current_nodes[nid] = n
-
-			changed_nodes = []
-			renamed_nodes = []
-			for nid, node in current_nodes.items():
-				if nid in self.known_nodes.keys():
-					if self.known_nodes[nid].online != current_nodes[nid].online:
-						changed_nodes.append(nid)
-					if self.known_nodes[nid].name != current_nodes[nid].name:
-						renamed_nodes.append(nid)
-
-			for nid in new_nodes:
-				self.eventHandler.newNode(current_nodes[nid])
-
-			for nid in really_gone_nodes:
-				self.eventHandler.nodeDeleted(self.known_nodes[nid])
-
-			for nid in changed_nodes:
-				self.eventHandler.nodeStatusChanged(current_nodes[nid])
-
-			for nid in renamed_nodes:
-				self.eventHandler.nodeRenamed(current_nodes[nid], self.known_nodes[nid])
-
-			# update global network status
-			self.last_nodes_online = self.num_nodes_online
-			self.last_nodes = self.num_nodes
-			self.last_clients = self.num_clients
-
-			self.num_nodes = len(current_nodes)
-			self.num_nodes_online = 0
-			self.num_clients = 0
-			for node in current_nodes.values():
-				self.num_clients += node.clients
-				if node.online:
-					self.num_nodes_online += 1
-
-			# Check new highscores
-			db = sqlite3.connect(config.DATABASE)
-
-			# per-node client highscore
-			for node in current_nodes.values():
-				if node.updateHighscore(db) and not firstRun and node.max_clients > 0:
-					self.eventHandler.highscoreClientsAtNode(node)
-
-			db.commit()
-
-			# nodes registered
-			if self.nodes_highscore.update(self.num_nodes):
-				self.nodes_highscore.save(db)
-				self.eventHandler.highscoreRegisteredNodes(self.num_nodes)
-
-			# nodes online
-			if self.nodes_online_highscore.update(self.num_nodes_online):
-				self.nodes_online_highscore.save(db)
-				self.eventHandler.highscoreOnlineNodes(self.num_nodes_online)
-
-			# clients
-			if self.clients_highscore.update(self.num_clients):
-				self.clients_highscore.save(db)
-				self.eventHandler.highscoreOnlineClients(self.num_clients)
-
-			db.commit()
-			db.close()
-
-			# write a log of changes in the network
-			self.log_network_changes(current_nodes, new_nodes, really_gone_nodes, renamed_nodes)
-
-			self.known_nodes = current_nodes
-
-	def log_network_changes(self, current_nodes, new_nodes, gone_nodes, renamed_nodes):
-		if self.num_nodes != self.last_nodes:
-			self.eventHandler.registeredNodesChanged(self.num_nodes)
-			if config.LOG_NODECOUNT:
-				with open(config.LOG_NODECOUNT, 'a') as logfile:
-					print("Number of nodes changed: {} -> {}".format(self.last_nodes, self.num_nodes))
-					logfile.write("{} {}\n".format(int(time.time()), self.num_nodes))
-
-		if self.num_nodes_online != self.last_nodes_online:
-			self.eventHandler.onlineNodesChanged(self.num_nodes_online)
-			if config.LOG_ONLINENODECOUNT:
-				with open(config.LOG_ONLINENODECOUNT, 'a') as logfile:
-					print("Number of online nodes changed: {} -> {}".format(self.last_nodes_online, self.num_nodes_online))
-					logfile.write("{} {}\n".format(int(time.time()), self.num_nodes_online))
-
-		if self.num_clients != self.last_clients:
-			self.eventHandler.clientsChanged(self.num_clients)
-			if config.LOG_TOTALCLIENTCOUNT:
-				with open(config.LOG_TOTALCLIENTCOUNT, 'a') as logfile:
-					print("Number of connected clients changed: {} -> {}".format(self.last_clients, self.num_clients))
-					logfile.write("{} {}\n".format(int(time.time()), self.num_clients))
-
-		current_nids = set(current_nodes.keys())
-		known_nids = set(self.known_nodes.keys())
-		all_nids = current_nids | known_nids
-		for nid in all_nids:
-			clientcount = -1
-			node = None
-			if nid in new_nodes:
-				# new node
-				clientcount = current_nodes[nid].clients
-				node = current_nodes[nid]
-			elif nid in gone_nodes:
-				# deleted node
-				clientcount = 0
-				node = self.known_nodes[nid]
-			elif self.known_nodes[nid].clients != current_nodes[nid].clients:
-				clientcount = current_nodes[nid].clients
-				node = current_nodes[nid]
-
-			if clientcount >= 0:
-				self.eventHandler.clientsAtNodeChanged(node)
-				if config.LOG_NODECLIENTCOUNT:
-					with open(config.LOG_NODECLIENTCOUNT, 'a') as logfile:
-						print("Number of clients for node {} changed: {}".format(nid, clientcount))
-						logfile.write("{} {} {}\n".format(int(time.time()), nid, clientcount))
-
-		if config.LOG_NODENAMES:
-			if not os.path.exists(config.LOG_NODENAMES):
-				# create the file with all current nodes
-				with open(config.LOG_NODENAMES, 'w') as nodefile:
-					for node in current_nodes.values():
-						nodefile.write("{} {}\n".format(node.nid, node.name))
-			else:
-				with open(config.LOG_NODENAMES, 'a') as nodefile:
-					for nid in set(new_nodes + renamed_nodes):
-						node = current_nodes[nid]
-						nodefile.write("{} {}\n".format(node.nid, node.name))
+				community.future.result(timeout=max(0, deadline - time.monotonic()))
+			except concurrent.futures.TimeoutError:
+				community.overruns += 1
+				community.log_message("Cycle exceeded its deadline of {:.1f} s ({} overruns)".format(
+					deadline - start, community.overruns))
+			except Exception:
+				community.log_message("Cycle failed:")
+				traceback.print_exc()
 
 
 def main():
@@ -690,6 +2162,26 @@ def main():
 	nickname = sys.argv[2]
 	target = sys.argv[3]
 
+	# communities sharing a file or port would corrupt each other's data
+	for name in COMMUNITY_PATHS + ['DISTSERV_FIFO', 'DISTSERV_PORT']:
+		values = []
+		for overrides in config.COMMUNITIES:
+			settings = CommunitySettings(overrides)
+
+			# only the broadcast in use needs its own FIFO or port
+			if name == 'DISTSERV_FIFO' and settings.BROADCAST_SERVER:
+				continue
+			if name == 'DISTSERV_PORT' and not settings.BROADCAST_SERVER:
+				continue
+
+			value = getattr(settings, name)
+			if value:
+				values.append(value)
+
+		if len(values) != len(set(values)):
+			print("Error: {} must be set to a different value for every community.".format(name))
+			sys.exit(1)
+
 	c = FreifunkBot(target)
 	try:
 		c.connect(server, port, nickname)
@@ -2,6 +2,7 @@
 # vim: noexpandtab ts=2 sw=2 sts=2
 
 import sys, os
+import json
 import time
 
 from glob import glob
@@ -10,8 +11,19 @@ sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 import config
 
 def node_plot_exists(nid):
+	if config.PLOT_NODE_MODE == 'json':
+		return nid in exported_nodes
 	return os.path.exists(os.path.join(config.PLOT_DIR, 'clients_{:s}_3h.svg'.format(nid)))
 
+# returns the nodes exported by plot/network.py for rendering in the browser
+def load_exported_nodes():
+	indexfile = os.path.join(config.PLOT_DIR, 'data', 'index.json')
+	if not os.path.exists(indexfile):
+		return {}
+
+	with open(indexfile, 'r') as f:
+		return json.load(f)['nodes']
+
 def mkplotline(title, html_id, basepath):
 	return """
 		<div id="{1:s}" class="history_box">
@@ -25,6 +37,24 @@ def mkplotline(title, html_id, basepath):
 		</div>
 		""".format(title, html_id, basepath)
 
+# like mkplotline(), but the plots are drawn by plots.js
+def mkchartline(title, html_id):
+	return """
+		<div id="{1:s}" class="history_box">
+			<h2>{0:s}</h2>
+			<p class="plot_line">
+				   <span class="plot 1year"></span><!--
+				--><span class="plot 30d"></span><!--
+				--><span class="plot 24h"></span><!--
+				--><span class="plot 3h"></span>
+			</p>
+		</div>
+		""".format(title, html_id)
+
+exported_nodes = {}
+if config.PLOT_NODE_MODE == 'json':
+	exported_nodes = load_exported_nodes()
+
 # load node names
 nodenames = {}
 with open(config.LOG_NODENAMES, 'r') as nodefile:
@@ -36,8 +66,8 @@ htmlstring = ""
 
 pathprefix = os.path.relpath(config.PLOT_DIR, os.path.dirname(config.PLOT_HTML))
 
-# export pathprefix to the javascript
-htmlstring += '<script type="text/javascript">pathprefix = "{:s}";</script>'.format(pathprefix)
+# export pathprefix and the plot mode to the javascript
+htmlstring += '<script type="text/javascript">pathprefix = "{:s}"; plotmode = "{:s}";</script>'.format(pathprefix, config.PLOT_NODE_MODE)
 
 htmlstring += mkplotline("Bekannte Knoten", 'nodes', os.path.join(pathprefix, 'nodes'))
 htmlstring += mkplotline("Knoten online", 'nodes_online', os.path.join(pathprefix, 'nodes_online'))
@@ -62,10 +92,16 @@ for idx in range(len(names)):
 	nid = nodenames[name]
 
 	if node_plot_exists(nid):
-		htmlstring += mkplotline(
-				"Clients an {}".format(name),
-				'node_clients',
-				os.path.join(pathprefix, 'clients_{}'.format(nid)))
+		if config.PLOT_NODE_MODE == 'json':
+			htmlstring += mkchartline("Clients an {}".format(name), 'node_clients')
+			htmlstring += '<script type="text/javascript">update_plots({}, {});</script>'.format(
+					json.dumps(nid),
+					json.dumps(name))
+		else:
+			htmlstring += mkplotline(
+					"Clients an {}".format(name),
+					'node_clients',
+					os.path.join(pathprefix, 'clients_{}'.format(nid)))
 		break;
 
 htmlstring += '<p class="date">Letzte Aktualisierung: {:s}</p>'.format(
@@ -1,14 +1,36 @@
 #!/usr/bin/env python3
 # vim: noexpandtab ts=2 sw=2 sts=2
 
-import pylab as p
+import numpy as np
+import hashlib
+import json
+import multiprocessing
 import time
 import zlib
 
+from matplotlib.figure import Figure
+
 import sys, os
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 import config
+import tsstore
+import rollup
+
+# length of the longest plotted history
+MAX_PLOT_AGE = 356*24*3600
+
+# length of the longest history plotted from raw data if rollups are available
+RAW_PLOT_AGE = 24*3600
+
+# plotted time windows: (file suffix, title label, history length, update interval,
+# bin size or None for a step plot of the raw data)
+WINDOWS = [
+	('1year', '1y',  MAX_PLOT_AGE, config.PLOT_UPDATE_INTV_1Y,  config.PLOT_ACC_TIME_1Y),
+	('30d',   '30d', 30*24*3600,   config.PLOT_UPDATE_INTV_30D, config.PLOT_ACC_TIME_30D),
+	('24h',   '24h', 24*3600,      config.PLOT_UPDATE_INTV_24H, None),
+	('3h',    '3h',  3*3600,       config.PLOT_UPDATE_INTV_3H,  None),
+]
 
 COLORS=[]
 
@@ -19,22 +41,39 @@ for r in [0x20, 0x65, 0xaa]:
 			cs = '#{:06x}'.format(c)
 			COLORS.append(cs)
 
+# bump to invalidate all cached plots after changes to the rendering
+PLOT_CACHE_VERSION = 1
+
+# number of runs kept in the cache statistics of the manifest
+PLOT_CACHE_RUNS = 100
+
+# directory in PLOT_DIR for the data exported with PLOT_NODE_MODE = 'json'
+EXPORT_DIR = 'data'
+
+# the plot cache manifest, see load_manifest()
+MANIFEST = {'plots': {}, 'runs': []}
+
+# all series to plot, as a map of name => dict (see add_series()). Filled before
+# the worker processes are forked, so they inherit the data instead of receiving
+# it pickled with every job.
+SERIES = {}
+
 def init_plot():
-	fig = p.figure(figsize=(4.5, 4.0))
+	fig = Figure(figsize=(4.5, 4.0))
 	ax = fig.add_axes([0.15, 0.19, 0.8, 0.67])
-	return fig
+	return fig, ax
 
-def finalize_plot(f, timestamp, ylabel, title, output_file):
-	p.axis('tight')
+def finalize_plot(fig, ax, timestamp, ylabel, title, output_file):
+	ax.axis('tight')
 
-	p.ylabel(ylabel)
-	p.xlabel('Zeit')
-	p.title(title)
-	p.grid()
+	ax.set_ylabel(ylabel)
+	ax.set_xlabel('Zeit')
+	ax.set_title(title)
+	ax.grid()
 
 	# adjust xticks
 	if len(timestamp) >= 2:
-		r = max(timestamp) - min(timestamp)
+		r = np.max(timestamp) - np.min(timestamp)
 		if r < 4*3600: # 3 hour plot
 			tickdist = 1800
 			timeformat = '%H:%M'
@@ -48,76 +87,120 @@ def finalize_plot(f, timestamp, ylabel, title, output_file):
 			tickdist = 60*86400
 			timeformat = '%m-%d\n%Y'
 
-		start = (p.floor(min(timestamp)/tickdist) + 1)*tickdist
-		ticks = p.arange(start, max(timestamp), tickdist)
+		start = (np.floor(np.min(timestamp)/tickdist) + 1)*tickdist
+		ticks = np.arange(start, np.max(timestamp), tickdist)
 	else:
-		ticks = p.xticks()[0]
+		ticks = ax.get_xticks()
 		ticks = ticks[0:len(ticks):3]
 		timeformat = '%Y-%m-%d\n%H:%M'
 	textticks = [time.strftime(timeformat, time.localtime(t)) for t in ticks]
 
 	# enforce y range
 	if len(timestamp) == 0:
-		p.ylim([0, 1])
-
-	p.xticks(ticks, textticks)
-	f.savefig(output_file, transparent=True)
+		ax.set_ylim([0, 1])
 
-	p.close(f)
+	ax.set_xticks(ticks)
+	ax.set_xticklabels(textticks)
+	fig.savefig(output_file, transparent=True)
 
 def plot(timestamp, ydata, ylabel, title, color, output_file):
-	f = init_plot()
+	fig, ax = init_plot()
 
-	p.step(timestamp, ydata, linewidth=2, color=color)
+	ax.step(timestamp, ydata, linewidth=2, color=color)
 
-	finalize_plot(f, timestamp, ylabel, title, output_file)
+	finalize_plot(fig, ax, timestamp, ylabel, title, output_file)
+
+# groups the samples into bins with a width of binsize and returns the bin start
+# times and the min/mean/max of every bin. timestamp must be sorted.
+def bin_minmax(timestamp, ydata, binsize):
+	timestamp = np.asarray(timestamp)
+	ydata = np.asarray(ydata, dtype=float)
+
+	if len(timestamp) == 0:
+		return timestamp, ydata, ydata, ydata
+
+	tsbins = np.floor_divide(timestamp, binsize) * binsize
+
+	# tsbins is sorted, so each bin is a contiguous range starting at start[i]
+	bins, start, counts = np.unique(tsbins, return_index=True, return_counts=True)
+
+	binmin = np.minimum.reduceat(ydata, start)
+	binmax = np.maximum.reduceat(ydata, start)
+	binavg = np.add.reduceat(ydata, start) / counts
+
+	return bins, binmin, binavg, binmax
 
 def plot_minmax(timestamp, ydata, ylabel, binsize, title, color, output_file):
-	f = init_plot()
+	sorted_ts, binmin, binavg, binmax = bin_minmax(timestamp, ydata, binsize)
+	plot_bins(sorted_ts, binmin, binavg, binmax, ylabel, title, color, output_file)
 
-	# sort data into bins with a width of binsize
-	tsbins = p.multiply(p.floor(p.divide(timestamp, binsize)), binsize);
+def plot_bins(sorted_ts, binmin, binavg, binmax, ylabel, title, color, output_file):
+	fig, ax = init_plot()
 
-	bins = {}
-	for i in range(len(timestamp)):
-		if tsbins[i] not in bins.keys():
-			bins[ tsbins[i] ] = [ ydata[i] ]
-		else:
-			bins[ tsbins[i] ].append(ydata[i])
+	ax.plot(sorted_ts, binmin,
+	        sorted_ts, binmax,
+	        linewidth=2, color=color)
+
+	ax.plot(sorted_ts, binavg,
+	        linewidth=2, color=color, linestyle='dashed', alpha=0.6)
+
+	ax.fill_between(sorted_ts, binmin, binmax, color=color, alpha=0.2)
 
-	sorted_ts = sorted(tsbins)
+	finalize_plot(fig, ax, sorted_ts, ylabel, title, output_file)
 
-	binsdata = {}
-	for ts, data in bins.items():
-		binsdata[ts] = (min(data), p.mean(data), max(data))
+# returns the samples of the last maxage seconds. timestamp must be sorted.
+def limitdata(timestamp, data, maxage, now=None):
+	if now is None:
+		now = time.time()
 
-	binsdata_ordered = {'min': [], 'avg': [], 'max': []}
-	for k in sorted_ts:
-		binsdata_ordered['min'].append(binsdata[k][0])
-		binsdata_ordered['avg'].append(binsdata[k][1])
-		binsdata_ordered['max'].append(binsdata[k][2])
+	first = np.searchsorted(timestamp, now - maxage, side='right')
+	return timestamp[first:], data[first:]
 
-	p.plot(sorted_ts, binsdata_ordered['min'],
-	       sorted_ts, binsdata_ordered['max'],
-	       linewidth=2, color=color)
+# returns the bins that end within the last maxage seconds
+def limitbins(bins, binsize, maxage):
+	sorted_ts, binmin, binavg, binmax = bins
+	first = np.searchsorted(sorted_ts, time.time() - maxage - binsize, side='right')
+	return sorted_ts[first:], binmin[first:], binavg[first:], binmax[first:]
 
-	p.plot(sorted_ts, binsdata_ordered['avg'],
-	       linewidth=2, color=color, linestyle='dashed', alpha=0.6)
+# loads the plot cache manifest: a map of plot file => hash of the data and
+# parameters it was rendered from, plus hit/miss statistics of the last runs
+def load_manifest():
+	manifest = {'plots': {}, 'runs': []}
 
-	p.fill_between(sorted_ts, binsdata_ordered['min'], binsdata_ordered['max'], color=color, alpha=0.2)
+	if config.PLOT_CACHE_MANIFEST and os.path.exists(config.PLOT_CACHE_MANIFEST):
+		try:
+			with open(config.PLOT_CACHE_MANIFEST, 'r') as manifestfile:
+				manifest.update(json.load(manifestfile))
+		except ValueError:
+			print("Plot cache manifest is corrupt, rendering all plots.")
 
-	finalize_plot(f, sorted_ts, ylabel, title, output_file)
+	return manifest
 
-def limitdata(timestamp, data, maxage):
-	out_timestamp = []
-	out_data = []
+def save_manifest(manifest):
+	if not config.PLOT_CACHE_MANIFEST:
+		return
 
-	for i in range(len(timestamp)):
-		if timestamp[i] > (time.time() - maxage):
-			out_timestamp.append(timestamp[i])
-			out_data.append(data[i])
+	manifest['runs'] = manifest['runs'][-PLOT_CACHE_RUNS:]
 
-	return out_timestamp, out_data
+	tmppath = config.PLOT_CACHE_MANIFEST + '.tmp'
+	with open(tmppath, 'w') as manifestfile:
+		json.dump(manifest, manifestfile, indent=1, sort_keys=True)
+	os.replace(tmppath, config.PLOT_CACHE_MANIFEST)
+
+# returns the cache key of a plot: a hash over everything that ends up in the
+# SVG except for the render time in the title
+def plot_digest(series, window, data):
+	h = hashlib.sha1()
+
+	params = [PLOT_CACHE_VERSION, window, series['ylabel'], series['basetitle'], series['color']]
+	h.update(json.dumps(params).encode('utf-8'))
+
+	for array in data:
+		array = np.ascontiguousarray(array)
+		h.update(array.dtype.str.encode('ascii'))
+		h.update(array.tobytes())
+
+	return h.hexdigest()
 
 def file_outdated(filename, max_age):
 	if not os.path.exists(filename):
@@ -129,157 +212,357 @@ def file_outdated(filename, max_age):
 	else:
 		return False
 
-def plot_limited(timestamp, ydata, ylabel, basetitle, color, base_output_file):
+# returns timestamp and ydata as arrays sorted by time
+def sorted_series(timestamp, ydata):
+	timestamp = np.asarray(timestamp)
+	ydata = np.asarray(ydata)
+
+	# log files are written in chronological order, unless the clock jumped
+	if np.any(np.diff(timestamp) < 0):
+		order = np.argsort(timestamp, kind='stable')
+		timestamp = timestamp[order]
+		ydata = ydata[order]
+
+	return timestamp, ydata
+
+# registers a series for plotting and returns the jobs for its outdated plots.
+# base_output_file is relative to PLOT_DIR. rollups is None or a map of
+# binsize => (bins, min, avg, max), used instead of the raw data for the 1 year
+# and 30 day plots.
+def add_series(name, timestamp, ydata, ylabel, basetitle, color, base_output_file, rollups=None):
+	timestamp, ydata = sorted_series(timestamp, ydata)
+
+	SERIES[name] = {'timestamp': timestamp,
+	                'ydata': ydata,
+	                'ylabel': ylabel,
+	                'basetitle': basetitle,
+	                'color': color,
+	                'base_output_file': base_output_file,
+	                'rollups': rollups}
+
+	jobs = []
+	for window in WINDOWS:
+		suffix, label, maxage, interval, binsize = window
+		targetfile = '{}_{}.svg'.format(base_output_file, suffix)
+		if file_outdated(os.path.join(config.PLOT_DIR, targetfile), interval):
+			jobs.append( (name, window) )
+
+	return jobs
+
+# renders one window of one series unless the cached plot was rendered from the
+# same data; runs in a worker process. Returns the plot file, its cache key,
+# whether it was a cache hit and the time taken.
+def render_job(job):
+	start = time.perf_counter()
+
+	name, window = job
+	suffix, label, maxage, interval, binsize = window
+	series = SERIES[name]
+
+	targetfile = '{}_{}.svg'.format(series['base_output_file'], suffix)
+	output_file = os.path.join(config.PLOT_DIR, targetfile)
+
+	if binsize is not None and series['rollups']:
+		data = limitbins(series['rollups'][binsize], binsize, maxage)
+	else:
+		data = limitdata(series['timestamp'], series['ydata'], maxage)
+
+	digest = plot_digest(series, window, data)
+	if MANIFEST['plots'].get(targetfile) == digest and os.path.exists(output_file):
+		# still up to date, restart its update interval
+		os.utime(output_file)
+		return targetfile, digest, True, time.perf_counter() - start
+
 	datetext = time.strftime('%Y-%m-%d %H:%M')
+	title = '{}\n({} @{})'.format(series['basetitle'], label, datetext)
 
-	targetfile = '{}_1year.svg'.format(base_output_file)
-	if file_outdated(targetfile, config.PLOT_UPDATE_INTV_1Y):
-		lim_timestamp, lim_data = limitdata(timestamp, ydata, 356*24*3600)
-		plot_minmax(lim_timestamp,
-		     lim_data,
-		     ylabel,
-		     config.PLOT_ACC_TIME_1Y,
-		     '{}\n(1y @{})'.format(basetitle, datetext),
-		     color,
-		     os.path.join(config.PLOT_DIR, targetfile))
-
-	targetfile = '{}_30d.svg'.format(base_output_file)
-	if file_outdated(targetfile, config.PLOT_UPDATE_INTV_30D):
-		lim_timestamp, lim_data = limitdata(timestamp, ydata, 30*24*3600)
-		plot_minmax(lim_timestamp,
-		     lim_data,
-		     ylabel,
-		     config.PLOT_ACC_TIME_30D,
-		     '{}\n(30d @{})'.format(basetitle, datetext),
-		     color,
-		     os.path.join(config.PLOT_DIR, targetfile))
-	
-	targetfile = '{}_24h.svg'.format(base_output_file)
-	if file_outdated(targetfile, config.PLOT_UPDATE_INTV_24H):
-		lim_timestamp, lim_data = limitdata(timestamp, ydata, 24*3600)
-		plot(lim_timestamp,
-		     lim_data,
-		     ylabel,
-		     '{}\n(24h @{})'.format(basetitle, datetext),
-		     color,
-		     os.path.join(config.PLOT_DIR, targetfile))
-
-	targetfile = '{}_3h.svg'.format(base_output_file)
-	if file_outdated(targetfile, config.PLOT_UPDATE_INTV_3H):
-		lim_timestamp, lim_data = limitdata(timestamp, ydata, 3*3600)
-		plot(lim_timestamp,
-		    lim_data,
-		    ylabel,
-		    '{}\n(3h @{})'.format(basetitle, datetext),
-		    color,
-		    os.path.join(config.PLOT_DIR, targetfile))
-
-#	 load node names
-nodenames = {}
-with open(config.LOG_NODENAMES, 'r') as nodefile:
-	for line in nodefile:
-		nid, name = line.split(' ', 1)
-		nodenames[nid] = name.strip()
-
-# global nodes
-timestamp = []
-nodes = []
-with open(config.LOG_NODECOUNT, 'r') as logfile:
-	print("Reading data for nodes...")
-	for line in logfile:
-		data = line.strip().split(' ')
-
-		timestamp.append(int(data[0]))
-		nodes.append(int(data[1]))
-
-	if p.any(p.array(timestamp) > (time.time() - config.PLOT_SKIP_TIMEOUT)):
-		print("Plotting...")
-		plot_limited(timestamp,
-		             nodes,
-		             'Knoten',
-		             'Registrierte Knoten',
-		             COLORS[0],
-		             os.path.join(config.PLOT_DIR, 'nodes'))
-	else:
-		print("Skipped.")
-
-# global online nodes
-timestamp = []
-nodes = []
-with open(config.LOG_ONLINENODECOUNT, 'r') as logfile:
-	print("Reading data for online nodes...")
-	for line in logfile:
-		data = line.strip().split(' ')
-
-		timestamp.append(int(data[0]))
-		nodes.append(int(data[1]))
-
-	if p.any(p.array(timestamp) > (time.time() - config.PLOT_SKIP_TIMEOUT)):
-		print("Plotting...")
-		plot_limited(timestamp,
-		             nodes,
-		             'Knoten',
-		             'Knoten online',
-		             COLORS[0],
-		             os.path.join(config.PLOT_DIR, 'nodes_online'))
+	if binsize is None:
+		plot(*data, series['ylabel'], title, series['color'], output_file)
+	elif series['rollups']:
+		plot_bins(*data, series['ylabel'], title, series['color'], output_file)
 	else:
-		print("Skipped.")
-
-# global clients
-timestamp = []
-clients = []
-with open(config.LOG_TOTALCLIENTCOUNT, 'r') as logfile:
-	print("Reading data for global clients...")
-	for line in logfile:
-		data = line.strip().split(' ')
-
-		timestamp.append(int(data[0]))
-		clients.append(int(data[1]))
-
-	if p.any(p.array(timestamp) > (time.time() - config.PLOT_SKIP_TIMEOUT)):
-		print("Plotting...")
-		plot_limited(timestamp,
-		             clients,
-		             'Clients',
-		             'Clients im Netz',
-		             COLORS[0],
-		             os.path.join(config.PLOT_DIR, 'clients'))
+		plot_minmax(*data, series['ylabel'], binsize, title, series['color'], output_file)
+
+	return targetfile, digest, False, time.perf_counter() - start
+
+# renders all jobs in a pool of worker processes and updates the cache manifest.
+# run contains additional statistics for the manifest.
+def render_all(jobs, run):
+	start = time.perf_counter()
+
+	processes = config.PLOT_PROCESSES or os.cpu_count()
+	print("Rendering {} plots in {} processes...".format(len(jobs), processes))
+
+	hits = 0
+	misses = 0
+
+	# the workers must be forked to inherit SERIES and MANIFEST
+	with multiprocessing.get_context('fork').Pool(processes) as pool:
+		for targetfile, digest, hit, duration in pool.imap_unordered(render_job, jobs):
+			MANIFEST['plots'][targetfile] = digest
+			if hit:
+				hits += 1
+				print("{:8.3f} s  {} (unchanged)".format(duration, targetfile))
+			else:
+				misses += 1
+				print("{:8.3f} s  {}".format(duration, targetfile))
+
+	duration = time.perf_counter() - start
+
+	run.update({'timestamp': int(time.time()),
+	            'hits': hits,
+	            'misses': misses,
+	            'duration': round(duration, 3)})
+	MANIFEST['runs'].append(run)
+	save_manifest(MANIFEST)
+
+	print("Rendered {} plots in {:.3f} s, {} unchanged plots skipped.".format(misses, duration, hits))
+
+# timestamps are stored as the first value followed by the differences
+def delta_encode(timestamp):
+	return np.diff(np.asarray(timestamp, dtype=np.int64), prepend=0).tolist()
+
+# returns one window of a series for the browser: the raw samples for the short
+# windows, min/avg/max bins for the long ones
+def export_window(timestamp, ydata, window, rollups):
+	suffix, label, maxage, interval, binsize = window
+
+	if binsize is None:
+		lim_timestamp, lim_data = limitdata(timestamp, ydata, maxage)
+		return {'t': delta_encode(lim_timestamp), 'y': lim_data.tolist()}
+
+	if rollups:
+		bins, binmin, binavg, binmax = limitbins(rollups[binsize], binsize, maxage)
 	else:
-		print("Skipped.")
-
-# clients for each node
-clientdata = {}
-
-with open(config.LOG_NODECLIENTCOUNT, 'r') as logfile:
-	print("Reading data for node clients...")
-	for line in logfile:
-		data = line.strip().split(' ')
+		bins, binmin, binavg, binmax = bin_minmax(*limitdata(timestamp, ydata, maxage), binsize)
+
+	return {'binsize': binsize,
+	        't': delta_encode(bins),
+	        'min': np.asarray(binmin, dtype=np.int64).tolist(),
+	        'avg': np.round(binavg, 2).tolist(),
+	        'max': np.asarray(binmax, dtype=np.int64).tolist()}
+
+# writes data as JSON to a file in EXPORT_DIR unless the file already has this
+# content. Returns True if the file was written.
+def export_file(filename, data):
+	path = os.path.join(config.PLOT_DIR, EXPORT_DIR, filename)
+	content = json.dumps(data, separators=(',', ':'))
+
+	digest = hashlib.sha1(content.encode('utf-8')).hexdigest()
+	key = os.path.join(EXPORT_DIR, filename)
+	if MANIFEST['plots'].get(key) == digest and os.path.exists(path):
+		return False
 
-		timestamp = int(data[0])
-		nid = data[1]
-		clients = int(data[2])
+	# replace atomically, browsers may be loading the file
+	tmppath = path + '.tmp'
+	with open(tmppath, 'w') as exportfile:
+		exportfile.write(content)
+	os.replace(tmppath, path)
+
+	MANIFEST['plots'][key] = digest
+	return True
+
+# exports the client count windows of a node for rendering in the browser
+def export_node(nid, timestamp, clients, color, rollups=None):
+	timestamp, clients = sorted_series(timestamp, clients)
+
+	windows = {}
+	for window in WINDOWS:
+		windows[window[0]] = export_window(timestamp, clients, window, rollups)
+
+	return export_file('clients_{}.json'.format(nid), {'color': color, 'windows': windows})
+
+# updates the rollup tiers of the binary store and returns them as a map of binsize => RollupTier
+def update_rollups():
+	tiers = rollup.load_tiers(config.TSSTORE_DIR)
+
+	print("Updating rollups...")
+	records = rollup.load_store_window(config.TSSTORE_DIR, min(tier.watermark for tier in tiers.values()))
+	for tier in tiers.values():
+		tier.update(records)
+
+	rollup.apply_retention(config.TSSTORE_DIR, tiers.values(), RAW_PLOT_AGE)
+
+	return tiers
+
+# returns a map of id => (timestamps, client counts) for the last maxage seconds
+# (if the binary store is used) or for all time (if the CSV log is used)
+def load_node_clients(maxage=MAX_PLOT_AGE):
+	clientdata = {}
+
+	if config.TSSTORE_DIR and os.path.isdir(config.TSSTORE_DIR):
+		print("Reading data for node clients from {}...".format(config.TSSTORE_DIR))
+		nids = tsstore.load_nodes(config.TSSTORE_DIR)
+		records = rollup.load_store_window(config.TSSTORE_DIR, time.time() - maxage)
+
+		# group the records by node, keeping them in chronological order
+		order = np.argsort(records['node'], kind='stable')
+		nodes = records['node'][order]
+		bounds = np.flatnonzero(np.diff(nodes)) + 1
+		for indices in np.split(order, bounds):
+			if len(indices):
+				nid = nids[records['node'][indices[0]]]
+				clientdata[nid] = (records['timestamp'][indices].astype(np.int64), records['count'][indices])
+
+		return clientdata
+
+	with open(config.LOG_NODECLIENTCOUNT, 'r') as logfile:
+		print("Reading data for node clients...")
+		for line in logfile:
+			data = line.strip().split(' ')
+
+			timestamp = int(data[0])
+			nid = data[1]
+			clients = int(data[2])
+
+			if nid not in clientdata.keys():
+				clientdata[nid] = ([], [])
+
+			clientdata[nid][0].append(timestamp)
+			clientdata[nid][1].append(clients)
+
+	return clientdata
+
+def main():
+	global MANIFEST
+	MANIFEST = load_manifest()
+
+	# load node names
+	nodenames = {}
+	with open(config.LOG_NODENAMES, 'r') as nodefile:
+		for line in nodefile:
+			nid, name = line.split(' ', 1)
+			nodenames[nid] = name.strip()
+
+	# list of (series, window) to render
+	jobs = []
+
+	# global nodes
+	timestamp = []
+	nodes = []
+	with open(config.LOG_NODECOUNT, 'r') as logfile:
+		print("Reading data for nodes...")
+		for line in logfile:
+			data = line.strip().split(' ')
+
+			timestamp.append(int(data[0]))
+			nodes.append(int(data[1]))
+
+		if np.any(np.array(timestamp) > (time.time() - config.PLOT_SKIP_TIMEOUT)):
+			jobs += add_series('nodes',
+			                   timestamp,
+			                   nodes,
+			                   'Knoten',
+			                   'Registrierte Knoten',
+			                   COLORS[0],
+			                   'nodes')
+		else:
+			print("Skipped.")
+
+	# global online nodes
+	timestamp = []
+	nodes = []
+	with open(config.LOG_ONLINENODECOUNT, 'r') as logfile:
+		print("Reading data for online nodes...")
+		for line in logfile:
+			data = line.strip().split(' ')
+
+			timestamp.append(int(data[0]))
+			nodes.append(int(data[1]))
+
+		if np.any(np.array(timestamp) > (time.time() - config.PLOT_SKIP_TIMEOUT)):
+			jobs += add_series('nodes_online',
+			                   timestamp,
+			                   nodes,
+			                   'Knoten',
+			                   'Knoten online',
+			                   COLORS[0],
+			                   'nodes_online')
+		else:
+			print("Skipped.")
+
+	# global clients
+	timestamp = []
+	clients = []
+	with open(config.LOG_TOTALCLIENTCOUNT, 'r') as logfile:
+		print("Reading data for global clients...")
+		for line in logfile:
+			data = line.strip().split(' ')
+
+			timestamp.append(int(data[0]))
+			clients.append(int(data[1]))
+
+		if np.any(np.array(timestamp) > (time.time() - config.PLOT_SKIP_TIMEOUT)):
+			jobs += add_series('clients',
+			                   timestamp,
+			                   clients,
+			                   'Clients',
+			                   'Clients im Netz',
+			                   COLORS[0],
+			                   'clients')
+		else:
+			print("Skipped.")
+
+	# clients for each node
+	if config.TSSTORE_DIR and os.path.isdir(config.TSSTORE_DIR):
+		# long-term plots come from the rollups, only the recent history is read raw
+		tiers = update_rollups()
+		node_index = {nid: index for index, nid in enumerate(tsstore.load_nodes(config.TSSTORE_DIR))}
+		clientdata = load_node_clients(RAW_PLOT_AGE)
+	else:
+		tiers = None
+		clientdata = load_node_clients()
 
-		if nid not in clientdata.keys():
-			clientdata[nid] = {'timestamp': [], 'clients': []}
+	# exported nodes, as a map of id => dict
+	export_index = {}
+	run = {}
 
-		clientdata[nid]['timestamp'].append(timestamp)
-		clientdata[nid]['clients'].append(clients)
+	if config.PLOT_NODE_MODE == 'json':
+		os.makedirs(os.path.join(config.PLOT_DIR, EXPORT_DIR), exist_ok=True)
+		run['exported'] = 0
+		run['export_unchanged'] = 0
 
-	for nid, data in clientdata.items():
+	for nid, (timestamp, clients) in clientdata.items():
 		if nid in nodenames.keys():
 			name = nodenames[nid]
 		else:
 			name = '[' + nid + ']'
 
-		if p.any(p.array(data['timestamp']) > (time.time() - config.PLOT_SKIP_TIMEOUT)):
-			color = COLORS[zlib.crc32(bytes(nid, 'ascii')) % len(COLORS)]
-
-			print("Plotting clients for node {} [{}]...".format(name, nid))
-			plot_limited(data['timestamp'],
-			             data['clients'],
-			             'Clients',
-			             'Clients an {}'.format(name),
-			             color,
-			             os.path.join(config.PLOT_DIR, 'clients_{}'.format(nid)))
+		color = COLORS[zlib.crc32(bytes(nid, 'ascii')) % len(COLORS)]
+
+		if np.any(np.array(timestamp) > (time.time() - config.PLOT_SKIP_TIMEOUT)):
+			rollups = None
+			if tiers:
+				rollups = {binsize: tier.series(node_index[nid]) for binsize, tier in tiers.items()}
+
+			if config.PLOT_NODE_MODE == 'json':
+				if export_node(nid, timestamp, clients, color, rollups):
+					run['exported'] += 1
+				else:
+					run['export_unchanged'] += 1
+				export_index[nid] = {'name': name, 'color': color}
+				continue
+
+			jobs += add_series('clients_' + nid,
+			                   timestamp,
+			                   clients,
+			                   'Clients',
+			                   'Clients an {}'.format(name),
+			                   color,
+			                   'clients_{}'.format(nid),
+			                   rollups)
 		else:
 			print("Plots for node {} [{}] skipped.".format(name, nid))
+
+			# keep the last export of inactive nodes available
+			if config.PLOT_NODE_MODE == 'json' and os.path.exists(os.path.join(config.PLOT_DIR, EXPORT_DIR, 'clients_{}.json'.format(nid))):
+				export_index[nid] = {'name': name, 'color': color}
+
+	if config.PLOT_NODE_MODE == 'json':
+		export_file('index.json', {'nodes': export_index})
+		print("Exported {} nodes, {} unchanged.".format(run['exported'], run['export_unchanged']))
+
+	render_all(jobs, run)
+
+if __name__ == "__main__":
+	main()
@@ -1,9 +1,27 @@
+var plottypes = ['1year', '30d', '24h', '3h'];
+var plotlabels = {'1year': '1y', '30d': '30d', '24h': '24h', '3h': '3h'};
+var weekdays = ['So', 'Mo', 'Di', 'Mi', 'Do', 'Fr', 'Sa'];
+
+// chart geometry, matching the SVGs rendered by network.py
+var chart_width = 450;
+var chart_height = 400;
+var chart_left = 67.5;
+var chart_right = 427.5;
+var chart_top = 56;
+var chart_bottom = 324;
+
 function update_plots(mac, name)
 {
 	divtag = document.getElementById('node_clients');
 	ptag = divtag.getElementsByTagName('p')[0];
 
-	plottypes = ['1year', '30d', '24h', '3h'];
+	h2tag = divtag.getElementsByTagName('h2')[0];
+	h2tag.innerHTML = 'Clients an ' + escape_html(name);
+
+	if(typeof plotmode !== 'undefined' && plotmode == 'json') {
+		load_charts(ptag, mac);
+		return;
+	}
 
 	for(i = 0; i < plottypes.length; i++) {
 		type = plottypes[i];
@@ -11,7 +29,178 @@ function update_plots(mac, name)
 
 		imgtag.src = pathprefix + "/clients_" + mac + "_" + type + ".svg";
 	}
+}
 
-	h2tag = divtag.getElementsByTagName('h2')[0];
-	h2tag.innerHTML = 'Clients an ' + name;
+// loads the exported data of a node and draws its charts into ptag
+function load_charts(ptag, mac)
+{
+	var request = new XMLHttpRequest();
+
+	request.onload = function() {
+		if(request.status != 200) {
+			return;
+		}
+
+		var data = JSON.parse(request.responseText);
+		for(var i = 0; i < plottypes.length; i++) {
+			var type = plottypes[i];
+			var spantag = ptag.getElementsByClassName(type)[0];
+
+			spantag.innerHTML = render_chart(data.windows[type], plotlabels[type], 'Clients', data.color);
+		}
+	};
+
+	request.open('GET', pathprefix + "/data/clients_" + mac + ".json");
+	request.send();
+}
+
+function escape_html(text)
+{
+	return String(text).replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;').replace(/"/g, '&quot;');
+}
+
+function pad2(n)
+{
+	return (n < 10 ? '0' : '') + n;
+}
+
+// timestamps are exported as the first value followed by the differences
+function delta_decode(deltas)
+{
+	var result = [];
+	var t = 0;
+
+	for(var i = 0; i < deltas.length; i++) {
+		t += deltas[i];
+		result.push(t);
+	}
+
+	return result;
+}
+
+// returns the tick distance and a function returning the label lines of a tick,
+// using the same rules as finalize_plot() in network.py
+function time_ticks(range)
+{
+	if(range < 4*3600) {
+		return [1800, function(d) { return [pad2(d.getHours()) + ':' + pad2(d.getMinutes())]; }];
+	} else if(range < 25*3600) {
+		return [6*3600, function(d) { return [pad2(d.getMonth() + 1) + '-' + pad2(d.getDate()), pad2(d.getHours()) + ':' + pad2(d.getMinutes())]; }];
+	} else if(range < 32*86400) {
+		return [4*86400, function(d) { return [weekdays[d.getDay()], pad2(d.getDate())]; }];
+	} else {
+		return [60*86400, function(d) { return [pad2(d.getMonth() + 1) + '-' + pad2(d.getDate()), String(d.getFullYear())]; }];
+	}
+}
+
+// returns a step width giving about 5 ticks between min and max
+function value_step(min, max)
+{
+	var raw = (max - min) / 5;
+	var magnitude = Math.pow(10, Math.floor(Math.log10(raw)));
+	var steps = [1, 2, 5, 10];
+
+	for(var i = 0; i < steps.length; i++) {
+		if(steps[i] * magnitude >= raw) {
+			return Math.max(1, steps[i] * magnitude);
+		}
+	}
+	return Math.max(1, 10 * magnitude);
+}
+
+function svg_path(points)
+{
+	var d = '';
+	for(var i = 0; i < points.length; i++) {
+		d += (i == 0 ? 'M' : 'L') + points[i][0].toFixed(1) + ',' + points[i][1].toFixed(1);
+	}
+	return d;
+}
+
+// returns the SVG markup for one exported window: a step plot of the raw samples
+// or min/max lines with a dashed average for binned data
+function render_chart(series, label, ylabel, color)
+{
+	var t = delta_decode(series.t);
+	var binned = ('binsize' in series);
+	var lists = binned ? [series.min, series.max] : [series.y];
+
+	var svg = '<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 ' + chart_width + ' ' + chart_height + '">';
+	svg += '<text x="' + (chart_width / 2) + '" y="' + (chart_top - 10) + '" text-anchor="middle" font-size="14">Clients (' + label + ')</text>';
+
+	if(t.length == 0) {
+		svg += '<rect x="' + chart_left + '" y="' + chart_top + '" width="' + (chart_right - chart_left) + '" height="' + (chart_bottom - chart_top) + '" fill="none" stroke="black"/>';
+		svg += '<text x="' + ((chart_left + chart_right) / 2) + '" y="' + ((chart_top + chart_bottom) / 2) + '" text-anchor="middle" font-size="12">Keine Daten</text>';
+		return svg + '</svg>';
+	}
+
+	var tmin = t[0];
+	var tmax = t[t.length - 1];
+	if(tmax == tmin) {
+		tmin -= 1;
+		tmax += 1;
+	}
+
+	var ymin = Infinity;
+	var ymax = -Infinity;
+	for(var i = 0; i < lists.length; i++) {
+		ymin = Math.min(ymin, Math.min.apply(null, lists[i]));
+		ymax = Math.max(ymax, Math.max.apply(null, lists[i]));
+	}
+	if(ymax == ymin) {
+		ymin -= 1;
+		ymax += 1;
+	}
+
+	var x = function(v) { return chart_left + (v - tmin) / (tmax - tmin) * (chart_right - chart_left); };
+	var y = function(v) { return chart_bottom - (v - ymin) / (ymax - ymin) * (chart_bottom - chart_top); };
+
+	// grid and value ticks
+	var step = value_step(ymin, ymax);
+	for(var v = Math.ceil(ymin / step) * step; v <= ymax; v += step) {
+		svg += '<line x1="' + chart_left + '" x2="' + chart_right + '" y1="' + y(v).toFixed(1) + '" y2="' + y(v).toFixed(1) + '" stroke="#b0b0b0" stroke-width="0.8"/>';
+		svg += '<text x="' + (chart_left - 5) + '" y="' + (y(v) + 4).toFixed(1) + '" text-anchor="end" font-size="11">' + v + '</text>';
+	}
+
+	// time ticks
+	var ticks = time_ticks(tmax - tmin);
+	for(var tick = (Math.floor(tmin / ticks[0]) + 1) * ticks[0]; tick < tmax; tick += ticks[0]) {
+		var lines = ticks[1](new Date(tick * 1000));
+
+		svg += '<line x1="' + x(tick).toFixed(1) + '" x2="' + x(tick).toFixed(1) + '" y1="' + chart_top + '" y2="' + chart_bottom + '" stroke="#b0b0b0" stroke-width="0.8"/>';
+		for(var j = 0; j < lines.length; j++) {
+			svg += '<text x="' + x(tick).toFixed(1) + '" y="' + (chart_bottom + 16 + 13 * j) + '" text-anchor="middle" font-size="11">' + lines[j] + '</text>';
+		}
+	}
+
+	if(binned) {
+		var minpoints = [];
+		var maxpoints = [];
+		var avgpoints = [];
+		for(var i = 0; i < t.length; i++) {
+			minpoints.push([x(t[i]), y(series.min[i])]);
+			maxpoints.push([x(t[i]), y(series.max[i])]);
+			avgpoints.push([x(t[i]), y(series.avg[i])]);
+		}
+
+		svg += '<path d="' + svg_path(minpoints.concat(maxpoints.slice().reverse())) + 'Z" fill="' + color + '" fill-opacity="0.2" stroke="none"/>';
+		svg += '<path d="' + svg_path(minpoints) + '" fill="none" stroke="' + color + '" stroke-width="2"/>';
+		svg += '<path d="' + svg_path(maxpoints) + '" fill="none" stroke="' + color + '" stroke-width="2"/>';
+		svg += '<path d="' + svg_path(avgpoints) + '" fill="none" stroke="' + color + '" stroke-width="2" stroke-dasharray="7,3" stroke-opacity="0.6"/>';
+	} else {
+		// steps like pylab.step(): each value is drawn up to its timestamp
+		var points = [[x(t[0]), y(series.y[0])]];
+		for(var i = 1; i < t.length; i++) {
+			points.push([x(t[i - 1]), y(series.y[i])]);
+			points.push([x(t[i]), y(series.y[i])]);
+		}
+
+		svg += '<path d="' + svg_path(points) + '" fill="none" stroke="' + color + '" stroke-width="2"/>';
+	}
+
+	svg += '<rect x="' + chart_left + '" y="' + chart_top + '" width="' + (chart_right - chart_left) + '" height="' + (chart_bottom - chart_top) + '" fill="none" stroke="black"/>';
+	svg += '<text x="' + ((chart_left + chart_right) / 2) + '" y="' + (chart_height - 20) + '" text-anchor="middle" font-size="12">Zeit</text>';
+	svg += '<text transform="translate(18,' + ((chart_top + chart_bottom) / 2) + ') rotate(-90)" text-anchor="middle" font-size="12">' + ylabel + '</text>';
+
+	return svg + '</svg>';
 }
@@ -0,0 +1,165 @@
+# vim: noexpandtab ts=2 sw=2 sts=2
+
+# Pre-aggregated min/avg/max bins of the per-node client counts, computed from
+# the binary store (see tsstore.py). Each tier has a fixed bin size and is stored
+# in the store directory as rollup_<binsize>.npz together with a watermark: all
+# raw records up to this timestamp are contained in the tier. Updates only read
+# the raw records after the watermark; older records appended by replay.py are
+# added with backfill().
+
+import sys, os
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+import config
+import tsstore
+
+ROLLUP_DTYPE = [('node', '<u4'), ('bin', '<u4'), ('min', '<i4'), ('max', '<i4'), ('sum', '<i8'), ('count', '<u4')]
+
+# combines entries with the same (node, bin) and returns them sorted by (node, bin)
+def merge_entries(entries):
+	if len(entries) == 0:
+		return entries
+
+	entries = entries[np.lexsort((entries['bin'], entries['node']))]
+
+	key = entries['node'].astype(np.uint64) << np.uint64(32) | entries['bin'].astype(np.uint64)
+	start = np.flatnonzero(np.concatenate(([True], key[1:] != key[:-1])))
+
+	merged = np.empty(len(start), dtype=ROLLUP_DTYPE)
+	merged['node'] = entries['node'][start]
+	merged['bin'] = entries['bin'][start]
+	merged['min'] = np.minimum.reduceat(entries['min'], start)
+	merged['max'] = np.maximum.reduceat(entries['max'], start)
+	merged['sum'] = np.add.reduceat(entries['sum'], start)
+	merged['count'] = np.add.reduceat(entries['count'], start)
+	return merged
+
+# memory-maps the blocks of the client count store that overlap the time after
+# start (and up to end, if given) and returns the records in this range
+def load_store_window(path, start, end=None):
+	parts = []
+	for block in tsstore.list_blocks(path):
+		if (block + 1) * config.TSSTORE_BLOCK_SECONDS <= start:
+			continue
+		if end is not None and block * config.TSSTORE_BLOCK_SECONDS > end:
+			continue
+
+		filename = tsstore.block_path(path, block)
+		num_records = os.path.getsize(filename) // tsstore.RECORD_SIZE
+		if num_records == 0:
+			continue
+
+		records = np.memmap(filename, dtype=tsstore.RECORD_DTYPE, mode='r', shape=(num_records,))
+		ts = records['timestamp']
+		if np.all(ts[1:] >= ts[:-1]):
+			records = records[np.searchsorted(ts, start, side='right'):]
+		else:
+			# the clock went backwards while the block was written
+			records = records[ts > start]
+
+		parts.append(records)
+
+	if not parts:
+		return np.empty(0, dtype=tsstore.RECORD_DTYPE)
+
+	records = np.concatenate(parts)
+	if end is not None:
+		records = records[records['timestamp'] <= end]
+	return records
+
+# one bin per raw record, to be merged into a tier
+def make_entries(records, binsize):
+	new = np.empty(len(records), dtype=ROLLUP_DTYPE)
+	new['node'] = records['node']
+	new['bin'] = records['timestamp'] // binsize
+	new['min'] = records['count']
+	new['max'] = records['count']
+	new['sum'] = records['count']
+	new['count'] = 1
+	return new
+
+class RollupTier:
+	def __init__(self, storepath, binsize):
+		self.storepath = storepath
+		self.binsize = binsize
+		self.path = os.path.join(storepath, 'rollup_{}.npz'.format(binsize))
+
+		self.entries = np.empty(0, dtype=ROLLUP_DTYPE)
+		self.watermark = 0
+
+		if os.path.exists(self.path):
+			with np.load(self.path) as data:
+				self.entries = data['entries']
+				self.watermark = int(data['watermark'])
+
+	def save(self):
+		tmppath = self.path + '.tmp.npz'
+		np.savez(tmppath, entries=self.entries, watermark=np.int64(self.watermark))
+		os.replace(tmppath, self.path)
+
+	# adds the raw records newer than the watermark. records must contain all raw
+	# records after the watermark.
+	def update(self, records):
+		records = records[records['timestamp'] > self.watermark]
+		if len(records) == 0:
+			return
+
+		# the newest cycle may still be written by the bot; leave it for the next update
+		newest = records['timestamp'].max()
+		records = records[records['timestamp'] < newest]
+		if len(records) == 0:
+			return
+
+		self.entries = merge_entries(np.concatenate((self.entries, make_entries(records, self.binsize))))
+		self.watermark = int(records['timestamp'].max())
+		self.save()
+
+	# adds raw records up to the watermark, which update() skips because they were
+	# appended to the store later (by replay.py)
+	def backfill(self, records):
+		records = records[records['timestamp'] <= self.watermark]
+		if len(records) == 0:
+			return
+
+		self.entries = merge_entries(np.concatenate((self.entries, make_entries(records, self.binsize))))
+		self.save()
+
+	# returns bin start times, min, avg and max of a node, for bins ending after start
+	def series(self, node, start=0):
+		first = np.searchsorted(self.entries['node'], node, side='left')
+		last = np.searchsorted(self.entries['node'], node, side='right')
+		entries = self.entries[first:last]
+
+		bins = entries['bin'].astype(np.int64) * self.binsize
+		entries = entries[bins + self.binsize > start]
+		bins = bins[bins + self.binsize > start]
+
+		return bins, entries['min'], entries['sum'] / entries['count'], entries['max']
+
+# returns the tiers of the store as a map of binsize => RollupTier
+def load_tiers(storepath):
+	return {binsize: RollupTier(storepath, binsize) for binsize in [config.PLOT_ACC_TIME_30D, config.PLOT_ACC_TIME_1Y]}
+
+# adds the raw records from start to end, written by replay.py, to the tiers that
+# already contain later records. Newer records are added by the next update.
+def backfill(storepath, tiers, start, end):
+	records = load_store_window(storepath, start - 1, end)
+	for tier in tiers:
+		tier.backfill(records)
+
+# deletes raw blocks older than TSSTORE_RAW_RETENTION that are contained in all
+# tiers. Raw data younger than min_age is kept, as the short plots are drawn from it.
+def apply_retention(storepath, tiers, min_age):
+	if config.TSSTORE_RAW_RETENTION is None:
+		return
+
+	retention = max(config.TSSTORE_RAW_RETENTION, min_age)
+	limit = min([time.time() - retention] + [tier.watermark for tier in tiers])
+
+	for block in tsstore.list_blocks(storepath):
+		if (block + 1) * config.TSSTORE_BLOCK_SECONDS <= limit:
+			print("Removing raw data block {}".format(block))
+			os.remove(tsstore.block_path(storepath, block))
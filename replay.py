@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# vim: noexpandtab ts=2 sw=2 sts=2
+
+# Feeds archived nodes.json snapshots through the bot's update cycle as fast as
+# possible, to backfill the logs, the binary store and the highscores, or to
+# measure the cycle on real data. The clock of every cycle is the 'timestamp'
+# of its snapshot (or the file's modification time if it has none). Nothing is
+# sent to IRC or to the broadcast, and no checkpoint is written.
+#
+# The bot must be stopped while replaying, as both write the same database, logs
+# and binary store (replay.py refuses to start otherwise). The plot script must
+# not run either: it may delete raw blocks of the binary store before replay.py
+# has added them to the rollups of the 30 day and 1 year plots at the end. Only
+# replay snapshots the binary store does not contain yet, their client counts
+# would be counted twice in the rollups otherwise.
+#
+# The snapshots are read from a directory, in the order of their file names, or
+# from a tarball, in the order of the archive (create it with tar --sort=name).
+# Files ending in .gz are decompressed. Snapshots that are not newer than the
+# previous one are skipped, as the logs must stay in chronological order.
+#
+# usage: replay.py <directory or tarball> [<community name>]
+#   replays into the files of the community configured in config.py, or of the
+#   named entry of COMMUNITIES
+
+import contextlib
+import datetime
+import gzip
+import hashlib
+import os
+import sys
+import tarfile
+import time
+
+import config
+import freifunk_bot
+
+# stands in for the OutboundQueue and drops all messages
+class NullQueue:
+	def put(self, method, target, message, priority):
+		pass
+
+# stands in for the broadcast FIFO or server and drops all events
+class NullBroadcast:
+	def write(self, data, count, snap):
+		pass
+
+	def stats(self):
+		return {}
+
+# nodes.json timestamps are ISO 8601 and in UTC unless they name a time zone
+def parse_timestamp(value):
+	if isinstance(value, (int, float)):
+		return float(value)
+
+	dt = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+	if dt.tzinfo is None:
+		dt = dt.replace(tzinfo=datetime.timezone.utc)
+	return dt.timestamp()
+
+# yields (name, modification time, body) of every snapshot in path
+def iter_snapshots(path):
+	if os.path.isdir(path):
+		for name in sorted(os.listdir(path)):
+			filepath = os.path.join(path, name)
+			if not os.path.isfile(filepath):
+				continue
+
+			with open(filepath, 'rb') as f:
+				body = f.read()
+			yield name, os.path.getmtime(filepath), body
+	else:
+		# read as a stream, a compressed tarball cannot be accessed randomly
+		with tarfile.open(path, 'r|*') as tar:
+			for member in tar:
+				if not member.isfile():
+					continue
+
+				yield member.name, member.mtime, tar.extractfile(member).read()
+
+def replay(path, community_name):
+	overrides = {}
+	for entry in config.COMMUNITIES:
+		if entry.get('NAME') == community_name:
+			overrides = entry
+			break
+	else:
+		if community_name is not None:
+			print("Error: there is no community named {}.".format(community_name))
+			sys.exit(1)
+
+	# the replayed state must not be mixed with the checkpoint of the running bot
+	overrides = dict(overrides, CHECKPOINT_FILE=None)
+
+	community = freifunk_bot.Community(freifunk_bot.CommunitySettings(overrides),
+	                                   community_name, None, NullQueue(), NullBroadcast())
+
+	# the bot's per-cycle output is not shown
+	devnull = open(os.devnull, 'w')
+
+	cycles = 0
+	skipped = 0
+	first_timestamp = None
+	last_timestamp = None
+	last_hash = None
+	start = time.monotonic()
+
+	for name, mtime, body in iter_snapshots(path):
+		if name.endswith('.gz'):
+			body = gzip.decompress(body)
+
+		# like NodesFetcher, an unchanged file is not a new cycle
+		body_hash = hashlib.sha1(body).digest()
+		if body_hash == last_hash:
+			skipped += 1
+			continue
+		last_hash = body_hash
+
+		cycle_start = time.monotonic()
+
+		header = {}
+		try:
+			current_nodes = freifunk_bot.parse_nodes(body, community.snapshot.nodes, header)
+			timestamp = parse_timestamp(header['timestamp']) if 'timestamp' in header else mtime
+		except (ValueError, KeyError, TypeError) as e:
+			print("{}: failed to parse: {}".format(name, str(e)))
+			skipped += 1
+			continue
+
+		community.metrics.observe('parse', cycle_start)
+		community.metrics.count('nodes_parsed', len(current_nodes))
+
+		if last_timestamp is not None and timestamp <= last_timestamp:
+			print("{}: skipped, not newer than the previous snapshot".format(name))
+			skipped += 1
+			continue
+		last_timestamp = timestamp
+		if first_timestamp is None:
+			first_timestamp = timestamp
+
+		with contextlib.redirect_stdout(devnull):
+			with community.cycle_lock:
+				community.update_network(current_nodes, timestamp)
+
+		community.metrics.observe('cycle', cycle_start)
+
+		cycles += 1
+		if cycles % 100 == 0:
+			print("{} cycles, at {}".format(cycles,
+				time.strftime(config.TIME_FORMAT, time.localtime(timestamp))))
+
+	community.close()
+
+	# the rollups only read records newer than their watermark by themselves
+	if community.clientStore and cycles:
+		sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'plot'))
+		import rollup
+
+		storepath = community.settings.TSSTORE_DIR
+		rollup.backfill(storepath, rollup.load_tiers(storepath).values(), int(first_timestamp), int(last_timestamp))
+
+	duration = time.monotonic() - start
+	print("Replayed {} cycles in {:.1f} s ({:.0f} cycles per minute), skipped {} snapshots.".format(
+		cycles, duration, cycles / duration * 60 if duration else 0, skipped))
+
+	stats = community.metrics.stats()
+	for phase in freifunk_bot.CycleMetrics.PHASES:
+		histogram = stats['phases'][phase]
+		if histogram['count']:
+			print("  {:15} {:8.3f} s on average, {:8.3f} s max".format(
+				phase, histogram['sum'] / histogram['count'], histogram['max']))
+
+if __name__ == "__main__":
+	if len(sys.argv) not in (2, 3):
+		print("Usage: replay.py <directory or tarball> [<community name>]")
+		sys.exit(1)
+
+	replay(sys.argv[1], sys.argv[2] if len(sys.argv) == 3 else None)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# vim: noexpandtab ts=2 sw=2 sts=2
+
+# Binary store for the per-node client counts, written by the bot next to
+# LOG_NODECLIENTCOUNT and memory-mapped by the plot scripts.
+#
+# The store is a directory containing:
+#   nodes.txt        one node ID per line, the line number is the node index
+#   <block>.bin      fixed-width records (timestamp, node index, client count),
+#                    block = timestamp // TSSTORE_BLOCK_SECONDS
+#
+# Records are appended in chronological order, so each block file is sorted by
+# timestamp.
+#
+# usage: tsstore.py <nodeclients.csv> [<store directory>]
+#   imports an existing client count log into an empty store
+
+import os
+import struct
+import sys
+
+import config
+
+RECORD_FORMAT = '<IIi'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+# numpy dtype equivalent to RECORD_FORMAT
+RECORD_DTYPE = [('timestamp', '<u4'), ('node', '<u4'), ('count', '<i4')]
+
+NODES_FILE = 'nodes.txt'
+
+def block_path(path, block):
+	return os.path.join(path, '{:08d}.bin'.format(block))
+
+# returns the block numbers present in the store, sorted
+def list_blocks(path):
+	blocks = []
+	for filename in os.listdir(path):
+		name, ext = os.path.splitext(filename)
+		if ext == '.bin' and name.isdigit():
+			blocks.append(int(name))
+	return sorted(blocks)
+
+# returns the list of node IDs, indexed by node index
+def load_nodes(path):
+	nids = []
+	nodes_path = os.path.join(path, NODES_FILE)
+	if os.path.exists(nodes_path):
+		with open(nodes_path, 'r') as nodefile:
+			for line in nodefile:
+				nids.append(line.strip())
+	return nids
+
+class ClientCountStore:
+	def __init__(self, path):
+		self.path = path
+		os.makedirs(path, exist_ok=True)
+
+		# map of id => node index
+		self.nodes = {nid: index for index, nid in enumerate(load_nodes(path))}
+		self.nodefile = open(os.path.join(path, NODES_FILE), 'a')
+
+		self.block = None
+		self.blockfile = None
+
+		# list of packed records
+		self.pending = []
+		self.pendingNodes = False
+
+	def _nodeIndex(self, nid):
+		index = self.nodes.get(nid)
+		if index is None:
+			index = len(self.nodes)
+			self.nodes[nid] = index
+			self.nodefile.write(nid + "\n")
+			self.pendingNodes = True
+		return index
+
+	def _openBlock(self, block):
+		if self.blockfile:
+			self.blockfile.close()
+
+		blockfile = open(block_path(self.path, block), 'ab')
+
+		# drop a partial record left over by an interrupted write
+		size = blockfile.tell()
+		if size % RECORD_SIZE:
+			blockfile.truncate(size - size % RECORD_SIZE)
+
+		self.block = block
+		self.blockfile = blockfile
+
+	def add(self, timestamp, nid, count):
+		self.pending.append( (timestamp, struct.pack(RECORD_FORMAT, timestamp, self._nodeIndex(nid), count)) )
+
+	def flush(self):
+		# node IDs must be on disk before any record referencing them
+		if self.pendingNodes:
+			self.nodefile.flush()
+			self.pendingNodes = False
+
+		start = 0
+		while start < len(self.pending):
+			block = self.pending[start][0] // config.TSSTORE_BLOCK_SECONDS
+
+			end = start
+			while end < len(self.pending) and self.pending[end][0] // config.TSSTORE_BLOCK_SECONDS == block:
+				end += 1
+
+			if block != self.block:
+				self._openBlock(block)
+
+			self.blockfile.write(b"".join(record for timestamp, record in self.pending[start:end]))
+			self.blockfile.flush()
+			start = end
+
+		self.pending = []
+
+	def close(self):
+		self.flush()
+		self.nodefile.close()
+		if self.blockfile:
+			self.blockfile.close()
+
+def import_csv(csvpath, path):
+	# checked before the store creates the directory and its node file
+	if os.path.isdir(path) and (list_blocks(path) or load_nodes(path)):
+		print("Error: {} already contains data.".format(path))
+		sys.exit(1)
+
+	store = ClientCountStore(path)
+
+	records = []
+	with open(csvpath, 'r') as logfile:
+		for line in logfile:
+			data = line.strip().split(' ')
+			records.append( (int(data[0]), data[1], int(data[2])) )
+
+	# the store must be in chronological order, the log usually already is
+	records.sort(key=lambda record: record[0])
+
+	for i in range(len(records)):
+		store.add(*records[i])
+		if i % 100000 == 99999:
+			store.flush()
+
+	store.close()
+	print("Imported {} records of {} nodes.".format(len(records), len(store.nodes)))
+
+if __name__ == "__main__":
+	if len(sys.argv) not in (2, 3):
+		print("Usage: tsstore.py <nodeclients.csv> [<store directory>]")
+		sys.exit(1)
+
+	import_csv(sys.argv[1], sys.argv[2] if len(sys.argv) == 3 else config.TSSTORE_DIR)